@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Generate a synthetic TRLC workspace for benchmarking.
+
+Every package Pkg_<i> is declared in pkg_<i>/pkg_<i>.rsl and has its
+record objects in pkg_<i>/pkg_<i>.trlc. A package imports up to fan_out of
+the packages before it; its base record type has a link to the base type
+of every imported package, and every object links to an object of each.
+The workspace has no errors, so that rename is available.
+"""
+
+import argparse
+import os
+
+
+def package_name(i):
+    return "Pkg_%u" % i
+
+
+def imports_of(i, fan_out):
+    return [package_name(j)
+            for j in range(i - 1, max(i - fan_out, 0) - 1, -1)]
+
+
+def generate_rsl(i, types, fan_out, checks=True):
+    imports = imports_of(i, fan_out)
+    lines = ["package %s" % package_name(i)]
+    lines += ["import %s" % name for name in imports]
+    lines += [
+        "",
+        "enum Status { Draft Review Approved }",
+        "",
+        "type Item {",
+        "  /** The name of the item */",
+        "  name   String",
+        "  weight Integer",
+        "  status optional Status",
+    ]
+    for n, name in enumerate(imports):
+        lines.append("  link_%u optional %s.Item" % (n, name))
+    lines.append("}")
+    for m in range(1, types):
+        lines += [
+            "",
+            "type Item_%u extends Item {" % m,
+            "  value_%u optional Integer" % m,
+            "}",
+        ]
+    if checks:
+        lines += [
+            "",
+            "checks Item {",
+            '  weight >= 0, warning "weight should not be negative", weight',
+            '  len(name) > 0, error "name must not be empty", name',
+            "}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def generate_trlc(i, types, objects, fan_out):
+    imports = imports_of(i, fan_out)
+    lines = ["package %s" % package_name(i)]
+    lines += ["import %s" % name for name in imports]
+    for k in range(objects):
+        m = k % types
+        lines += [
+            "",
+            "%s Obj_%u {" % ("Item_%u" % m if m else "Item", k),
+            '  name   = "Object %u of %s"' % (k, package_name(i)),
+            "  weight = %u" % k,
+            "  status = Status.%s" % ("Draft", "Review", "Approved")[k % 3],
+        ]
+        for n, name in enumerate(imports):
+            lines.append("  link_%u = %s.Obj_%u" % (n, name, k))
+        if m:
+            lines.append("  value_%u = %u" % (m, k))
+        lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def generate(root,  # pylint: disable=R0917
+             packages, types, objects, fan_out=2, checks=True):
+    """Write the workspace below root and return the paths of the files
+    written, in the order of the packages."""
+    types = max(types, 1)
+    file_names = []
+    for i in range(packages):
+        directory = os.path.join(root, package_name(i).lower())
+        os.makedirs(directory, exist_ok=True)
+        for extension, content in (
+                (".rsl", generate_rsl(i, types, fan_out, checks)),
+                (".trlc", generate_trlc(i, types, objects, fan_out))):
+            file_name = os.path.join(directory,
+                                     package_name(i).lower() + extension)
+            with open(file_name, "w", encoding="UTF-8") as fd:
+                fd.write(content)
+            file_names.append(file_name)
+    return file_names
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("root", help="directory to write the workspace to")
+    ap.add_argument("--packages", type=int, default=20)
+    ap.add_argument("--types", type=int, default=5,
+                    help="record types per package")
+    ap.add_argument("--objects", type=int, default=50,
+                    help="record objects per package")
+    ap.add_argument("--fan-out", type=int, default=2,
+                    help="number of packages imported by each package")
+    ap.add_argument("--no-checks", action="store_true",
+                    help="do not generate user defined checks")
+    options = ap.parse_args()
+
+    file_names = generate(options.root, options.packages, options.types,
+                          options.objects, options.fan_out,
+                          not options.no_checks)
+    print("Generated %u files in %s" % (len(file_names), options.root))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Replay a recorded session against a TRLC language server.
+
+Record a session with `trlc-lsp --record session.jsonl` (e.g. by adding
+the option to the server command of the editor), then replay what the
+client sent:
+
+    python3 -m benchmarks.replay_session session.jsonl
+    python3 -m benchmarks.replay_session session.jsonl --speed 10
+    python3 -m benchmarks.replay_session session.jsonl --tcp 127.0.0.1:5678
+    python3 -m benchmarks.replay_session session.jsonl -- --record new.jsonl
+
+By default a server is started with --stdio from the working tree; with
+--tcp the replay connects to a server started with --tcp instead. Messages
+are sent with the delays of the recording, divided by --speed (0 sends
+them as fast as possible), except that the replay waits for the responses
+to initialize and shutdown, as clients do. Arguments after -- are passed
+on to the server. Requests of the server are answered with the responses
+recorded for the same method, in order; once these run out, with null, or
+with no value per item for workspace/configuration.
+
+Reported are the latency percentiles of every request method, and the time
+from every edit (didOpen, didChange, didClose) to the next "Diagnostics
+published" log message of the server, which it sends at the end of every
+parse. Edits coalesced into one parse all end with that parse.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+
+from trlc_lsp.recording import SERVER, read_session
+
+EDITS = ("textDocument/didOpen", "textDocument/didChange",
+         "textDocument/didClose")
+WAIT_FOR = ("initialize", "shutdown")
+PUBLISHED = "TRLC: Diagnostics published"
+
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+
+    def percentile(p):
+        return seconds[min(len(seconds) - 1, int(len(seconds) * p))] * 1000
+
+    return {"n": len(seconds),
+            "p50_ms": percentile(0.5),
+            "p90_ms": percentile(0.9),
+            "p99_ms": percentile(0.99),
+            "max_ms": seconds[-1] * 1000}
+
+
+def rewrite(message, replacements):
+    """Apply the (old, new) text replacements to the message."""
+    if not replacements:
+        return message
+    text = json.dumps(message)
+    for old, new in replacements:
+        text = text.replace(old, new)
+    return json.loads(text)
+
+
+def prepare(records, replacements):
+    """Split a recording into the timed messages of the client and the
+    responses of the client to requests of the server, by method."""
+    server_requests = {}
+    responses = {}
+    timeline = []
+    for timestamp, sender, message in records:
+        message = rewrite(message, replacements)
+        if sender == SERVER:
+            if "method" in message and "id" in message:
+                server_requests[message["id"]] = message["method"]
+        elif "method" in message:
+            timeline.append((timestamp, message))
+        elif message.get("id") in server_requests:
+            method = server_requests.pop(message["id"])
+            responses.setdefault(method, deque()).append(message)
+    return timeline, responses
+
+
+class Replay:
+    """The client side of a replayed session."""
+
+    def __init__(self, reader, writer, responses):
+        self.reader = reader
+        self.writer = writer
+        self.responses = responses
+        self.pending = {}
+        self.latencies = {}
+        self.edits = []
+        self.diagnostics_times = []
+        self.waiting = {}
+
+    async def send(self, message):
+        body = json.dumps(message).encode("UTF-8")
+        self.writer.write(b"Content-Length: %u\r\n\r\n" % len(body) + body)
+        await self.writer.drain()
+
+    async def receive(self):
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode("ASCII").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers["content-length"]))
+        return json.loads(body)
+
+    async def read_loop(self):
+        while True:
+            message = await self.receive()
+            if message is None:
+                return
+            now = time.perf_counter()
+            if "method" not in message:
+                self.handle_response(message, now)
+            elif "id" in message:
+                await self.answer(message)
+            elif (message["method"] == "window/logMessage" and
+                  message["params"]["message"].startswith(PUBLISHED)):
+                self.diagnostics_times.extend(now - sent
+                                              for sent in self.edits)
+                self.edits = []
+
+    def handle_response(self, message, now):
+        request = self.pending.pop(message.get("id"), None)
+        if request is None:
+            return
+        method, sent = request
+        self.latencies.setdefault(method, []).append(now - sent)
+        done = self.waiting.pop(message["id"], None)
+        if done is not None:
+            done.set()
+
+    async def answer(self, request):
+        """Answer a request of the server like the recorded client did."""
+        recorded = self.responses.get(request["method"])
+        if recorded:
+            response = dict(recorded.popleft())
+        elif request["method"] == "workspace/configuration":
+            # A list with one value per item, null if there is none
+            response = {"jsonrpc": "2.0",
+                        "result": [None] * len(request["params"]["items"])}
+        else:
+            response = {"jsonrpc": "2.0", "result": None}
+        response["id"] = request["id"]
+        await self.send(response)
+
+    async def play(self, timeline, speed):
+        start = time.perf_counter()
+        for timestamp, message in timeline:
+            if speed > 0:
+                delay = start + timestamp / speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            now = time.perf_counter()
+            if "id" in message:
+                self.pending[message["id"]] = (message["method"], now)
+            elif message["method"] in EDITS:
+                self.edits.append(now)
+            if message["method"] in WAIT_FOR:
+                done = asyncio.Event()
+                self.waiting[message["id"]] = done
+                await self.send(message)
+                await done.wait()
+                # Keep the recorded pace after waiting
+                start += time.perf_counter() - now
+            else:
+                await self.send(message)
+
+    async def settle(self, timeout):
+        """Wait for the outstanding responses and diagnostics."""
+        deadline = time.perf_counter() + timeout
+        while ((self.pending or self.edits) and
+               time.perf_counter() < deadline):
+            await asyncio.sleep(0.05)
+
+    def report(self):
+        return {
+            "requests": {method: percentiles(seconds)
+                         for method, seconds in sorted(
+                             self.latencies.items())},
+            "time_to_diagnostics": (percentiles(self.diagnostics_times)
+                                    if self.diagnostics_times else None),
+            "unanswered": sorted({method
+                                  for method, _ in self.pending.values()}),
+            "edits_without_diagnostics": len(self.edits),
+        }
+
+
+async def replay(options):
+    records = read_session(options.session)
+    replacements = [tuple(replacement.split("=", 1))
+                    for replacement in options.replace or []]
+    timeline, responses = prepare(records, replacements)
+    if not any(message["method"] == "exit" for _, message in timeline):
+        last = timeline[-1][0] if timeline else 0
+        timeline += [(last, {"jsonrpc": "2.0", "id": "replay-shutdown",
+                             "method": "shutdown"}),
+                     (last, {"jsonrpc": "2.0", "method": "exit"})]
+    # Stop before shutting down, to wait for the last responses
+    split = next(n for n, (_, message) in enumerate(timeline)
+                 if message["method"] in ("shutdown", "exit"))
+
+    process = None
+    if options.tcp:
+        host, _, port = options.tcp.rpartition(":")
+        reader, writer = await asyncio.open_connection(host or "127.0.0.1",
+                                                       int(port))
+    else:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "trlc_lsp", "--stdio",
+            *options.server_args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=2 ** 26)
+        reader, writer = process.stdout, process.stdin
+
+    session = Replay(reader, writer, responses)
+    read_task = asyncio.ensure_future(session.read_loop())
+    start = time.perf_counter()
+    await session.play(timeline[:split], options.speed)
+    await session.settle(options.settle)
+    result = session.report()
+    result["seconds"] = time.perf_counter() - start
+    result["messages"] = split
+    result["speed"] = options.speed
+
+    await session.play(timeline[split:], 0)
+    if process is not None:
+        try:
+            await asyncio.wait_for(process.wait(), 10)
+        except asyncio.TimeoutError:
+            process.kill()
+    else:
+        writer.close()
+    read_task.cancel()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("session",
+                    help="session recorded with trlc-lsp --record")
+    ap.add_argument("--speed", type=float, default=1,
+                    help=("divide the recorded delays by this factor;"
+                          " 0 sends all messages at once (default: 1)"))
+    ap.add_argument("--tcp", metavar="HOST:PORT",
+                    help="connect to a server started with --tcp")
+    ap.add_argument("--replace", action="append", metavar="OLD=NEW",
+                    help=("replace text in all messages, e.g. to move the"
+                          " workspace: file:///old/ws=file:///new/ws"))
+    ap.add_argument("--settle", type=float, default=30,
+                    help=("seconds to wait for outstanding responses and"
+                          " diagnostics at the end (default: 30)"))
+    ap.add_argument("--output", default=None,
+                    help="write the JSON results to this file")
+    # Everything after -- goes to the server, also options of its own
+    argv = sys.argv[1:]
+    server_args = []
+    if "--" in argv:
+        server_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    ap.usage = "%(prog)s [options] session [-- server arguments]"
+    options = ap.parse_args(argv)
+    options.server_args = server_args
+
+    text = json.dumps(asyncio.run(replay(options)), indent=2)
+    if options.output:
+        with open(options.output, "w", encoding="UTF-8") as fd:
+            fd.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
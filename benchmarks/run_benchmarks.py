@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Benchmark the TRLC language server on synthetic workspaces.
+
+The server runs in-process, without a client: its messages are serialized
+as usual and then discarded. For every scale point a workspace is
+generated (see generate_workspace.py) and the following is measured:
+
+- validate_cold: full parse with empty caches
+- validate_warm: full parse of a new server instance with warm caches
+- validate_edit: incremental parse after an edit of one file
+- completion, completion_resolve, hover, references, rename,
+  semantic_tokens_full, semantic_tokens_range, document_symbol,
+  folding_range and workspace_symbol: handler latency, repeated --repeat
+  times
+
+Results are written as JSON, so that runs can be compared. Run it from
+the root of the repository, to benchmark the working tree:
+
+    python3 -m benchmarks.run_benchmarks --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from lsprotocol.types import (ClientCapabilities, CompletionContext,
+                              CompletionParams, CompletionTriggerKind,
+                              DocumentSymbolParams, FoldingRangeParams,
+                              InitializeParams, Position, Range,
+                              ReferenceContext, ReferenceParams,
+                              RenameParams, SemanticTokensParams,
+                              SemanticTokensRangeParams,
+                              TextDocumentIdentifier,
+                              TextDocumentPositionParams, WorkspaceFolder,
+                              WorkspaceSymbolParams)
+from trlc.version import TRLC_VERSION
+
+from trlc_lsp import server
+from trlc_lsp.cache import Token_Cache, Verification_Cache
+from trlc_lsp.trlc_utils import path_to_uri
+
+from .generate_workspace import generate, package_name
+
+DEFAULT_SCALES = ["10x3x20", "40x5x50", "100x5x100"]
+
+
+class Null_Writer:
+    """Stands in for the connection to the client."""
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+
+    def close(self):
+        pass
+
+
+def create_server(root, cache_dir, verify):
+    ls = server.TrlcLanguageServer("trlc-benchmark", "v0")
+    ls.protocol.set_writer(Null_Writer())
+    uri = path_to_uri(root)
+    for _ in ls.protocol.lsp_initialize(InitializeParams(
+            capabilities=ClientCapabilities(),
+            root_uri=uri,
+            workspace_folders=[WorkspaceFolder(uri=uri, name="benchmark")])):
+        pass
+
+    ls.verify_cache = Verification_Cache(
+        os.path.join(cache_dir, "verification.json"))
+    ls.token_cache = Token_Cache(os.path.join(cache_dir, "tokens"))
+    ls.lexer_pool.token_cache = ls.token_cache
+    ls.apply_config({"parsing": "full", "verify": verify})
+    return ls
+
+
+def summarize(seconds):
+    seconds = sorted(seconds)
+    p95 = seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))]
+    return {"n": len(seconds),
+            "min_ms": seconds[0] * 1000,
+            "median_ms": statistics.median(seconds) * 1000,
+            "p95_ms": p95 * 1000,
+            "max_ms": seconds[-1] * 1000}
+
+
+def measure(function, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds)
+
+
+def find(file_name, text, offset=0):
+    """Return the position of the first occurrence of text in the file,
+    moved by offset characters."""
+    with open(file_name, "r", encoding="UTF-8") as fd:
+        for line_no, line in enumerate(fd):
+            col = line.find(text)
+            if col >= 0:
+                return Position(line=line_no, character=col + offset)
+    raise ValueError("%s not found in %s" % (text, file_name))
+
+
+def benchmark_handlers(ls, file_names, repeat):
+    """Measure the request handlers on the files of the last package."""
+    rsl_file, trlc_file = file_names[-2:]
+    rsl_doc = TextDocumentIdentifier(uri=path_to_uri(rsl_file))
+    trlc_doc = TextDocumentIdentifier(uri=path_to_uri(trlc_file))
+
+    # Record references to the objects of an imported package
+    link = find(trlc_file, "link_0 =", len("link_0 = "))
+    completion = CompletionParams(
+        text_document=trlc_doc,
+        position=link,
+        context=CompletionContext(
+            trigger_kind=CompletionTriggerKind.TriggerCharacter,
+            trigger_character=" "))
+    # The description of a component
+    hover = TextDocumentPositionParams(
+        text_document=trlc_doc,
+        position=find(trlc_file, "name   =", 1))
+    # The base type, referred to by many objects
+    base_type = find(rsl_file, "type Item {", len("type "))
+    references = ReferenceParams(
+        text_document=rsl_doc,
+        position=base_type,
+        context=ReferenceContext(include_declaration=True))
+    rename = RenameParams(text_document=rsl_doc,
+                          position=base_type,
+                          new_name="Renamed")
+
+    def semantic_tokens_full():
+        # Measure the request, not the result id cache
+        ls.semantic_results.clear()
+        server.semantic_tokens(ls, SemanticTokensParams(
+            text_document=trlc_doc))
+
+    last_line = find(trlc_file, "package").line + 200
+    semantic_range = SemanticTokensRangeParams(
+        text_document=trlc_doc,
+        range=Range(start=Position(line=last_line - 100, character=0),
+                    end=Position(line=last_line, character=0)))
+
+    item = server.completion(ls, completion).items[0]
+    results = {
+        "completion": measure(
+            lambda: server.completion(ls, completion), repeat),
+        "completion_resolve": measure(
+            lambda: server.completion_resolve(ls, item), repeat),
+        "hover": measure(
+            lambda: server.hover(ls, hover), repeat),
+        "references": measure(
+            lambda: server.references(ls, references), repeat),
+        "rename": measure(
+            lambda: server.rename(ls, rename), repeat),
+        "semantic_tokens_full": measure(semantic_tokens_full, repeat),
+        "semantic_tokens_range": measure(
+            lambda: server.semantic_tokens_range(ls, semantic_range),
+            repeat),
+        "document_symbol": measure(
+            lambda: server.document_symbol(ls, DocumentSymbolParams(
+                text_document=trlc_doc)), repeat),
+        "folding_range": measure(
+            lambda: server.folding_range(ls, FoldingRangeParams(
+                text_document=trlc_doc)), repeat),
+        "workspace_symbol": measure(
+            lambda: server.workspace_symbol(ls, WorkspaceSymbolParams(
+                query="obj_1")), repeat),
+    }
+
+    # Make sure the handlers did something
+    assert server.completion(ls, completion).items
+    assert server.completion_resolve(ls, item).detail
+    assert server.hover(ls, hover) is not None
+    assert len(server.references(ls, references)) > 1
+    assert server.rename(ls, rename).document_changes
+    assert server.document_symbol(ls, DocumentSymbolParams(
+        text_document=trlc_doc))
+    assert server.workspace_symbol(ls, WorkspaceSymbolParams(query="obj_1"))
+    return results
+
+
+def benchmark_scale(scale, options):
+    packages, types, objects = (int(n) for n in scale.split("x"))
+    work_dir = tempfile.mkdtemp(prefix="trlc-benchmark-")
+    try:
+        root = os.path.join(work_dir, "workspace")
+        cache_dir = os.path.join(work_dir, "cache")
+        file_names = generate(root, packages, types, objects,
+                              options.fan_out)
+        results = {}
+
+        ls = create_server(root, cache_dir, options.verify)
+        start = time.perf_counter()
+        ls.validate()
+        results["validate_cold"] = {"seconds": time.perf_counter() - start}
+        errors = [diagnostic.message
+                  for diagnostics in ls.snapshot.diagnostics.values()
+                  for diagnostic in diagnostics
+                  if diagnostic.severity == 1]
+        assert not errors, errors
+        ls.verify_cache.save()
+
+        ls = create_server(root, cache_dir, options.verify)
+        start = time.perf_counter()
+        ls.validate()
+        results["validate_warm"] = {"seconds": time.perf_counter() - start}
+
+        # Add an object to the package in the middle of the import chain
+        edited = file_names[(packages // 2) * 2 + 1]
+        with open(edited, "r", encoding="UTF-8") as fd:
+            content = fd.read()
+        ls.fh.update_files(path_to_uri(edited),
+                           content + '\nItem Extra {\n  name = "Extra"\n'
+                                     '  weight = 1\n}\n')
+        start = time.perf_counter()
+        ls.validate({edited})
+        results["validate_edit"] = {"seconds": time.perf_counter() - start}
+
+        results.update(benchmark_handlers(ls, file_names, options.repeat))
+        return {"scale": {"packages": packages,
+                          "types": types,
+                          "objects": objects,
+                          "fan_out": options.fan_out,
+                          "files": len(file_names),
+                          "package": package_name(packages - 1)},
+                "results": results}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--scale", action="append",
+                    help=("packages x types x objects per package, e.g."
+                          " 40x5x50; can be given more than once"
+                          " (default: %s)" % " ".join(DEFAULT_SCALES)))
+    ap.add_argument("--fan-out", type=int, default=2,
+                    help="number of packages imported by each package")
+    ap.add_argument("--repeat", type=int, default=20,
+                    help="number of times each handler is measured")
+    ap.add_argument("--verify", action="store_true",
+                    help="run CVC5 as part of validate")
+    ap.add_argument("--output", default=None,
+                    help="write the JSON results to this file")
+    options = ap.parse_args()
+
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "cpus": os.cpu_count(),
+              "trlc": TRLC_VERSION,
+              "verify": options.verify,
+              "points": []}
+    for scale in options.scale or DEFAULT_SCALES:
+        print("Benchmarking %s..." % scale, file=sys.stderr)
+        report["points"].append(benchmark_scale(scale, options))
+
+    text = json.dumps(report, indent=2)
+    if options.output:
+        with open(options.output, "w", encoding="UTF-8") as fd:
+            fd.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Tests of the caches persisted in the user cache directory."""
+
+import os
+import tempfile
+import unittest
+
+from trlc_lsp.cache import Token_Cache
+
+
+class Test_Token_Cache(unittest.TestCase):
+
+    STAMP = (1, None, "0")
+
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = Token_Cache(self.directory.name, max_entries=3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def store(self, *file_names):
+        for file_name in file_names:
+            self.cache.put(file_name, self.STAMP, [])
+
+    def set_used(self, file_name, used):
+        os.utime(self.cache.entry_name(file_name), ns=(used, used))
+
+    def cached(self):
+        return sorted(file_name
+                      for file_name in ("/a", "/b", "/c", "/d", "/e")
+                      if os.path.exists(self.cache.entry_name(file_name)))
+
+    def test_least_recently_used_evicted(self):
+        self.store("/a", "/b", "/c", "/d")
+        for used, file_name in enumerate(("/a", "/b", "/c", "/d")):
+            self.set_used(file_name, used * 10**9)
+        self.assertEqual(self.cache.get("/a", self.STAMP), [])
+        self.cache.evict()
+        self.assertEqual(self.cached(), ["/a", "/c", "/d"])
+
+    def test_entries_of_earlier_sessions_evicted(self):
+        self.store("/a", "/b", "/c", "/d")
+        for used, file_name in enumerate(("/a", "/b", "/c", "/d")):
+            self.set_used(file_name, used * 10**9)
+        # The first store of a new session checks the directory
+        self.cache = Token_Cache(self.directory.name, max_entries=3)
+        self.store("/e")
+        self.assertEqual(self.cached(), ["/c", "/d", "/e"])
+
+    def test_no_eviction_below_limit(self):
+        self.store("/a", "/b")
+        self.cache.evict()
+        self.assertEqual(self.cached(), ["/a", "/b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Tests of incremental parses against full parses of the same files."""
+
+import os
+import tempfile
+import unittest
+
+from lsprotocol.types import (ClientCapabilities, InitializeParams,
+                              WorkspaceFolder)
+from trlc.ast import Package
+
+from trlc_lsp.cache import Token_Cache
+from trlc_lsp.server import TrlcLanguageServer
+from trlc_lsp.trlc_utils import path_to_uri
+
+
+class Null_Writer:
+    """Stands in for the connection to the client."""
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class Test_Incremental_Parse(unittest.TestCase):
+
+    FILES = {
+        "a.rsl": "package A\ntype T {\n  x Integer\n}\n",
+        "a.trlc": "package A\nT a1 {\n  x = 1\n}\n",
+        "b.rsl": "package B\ntype T {\n  x Integer\n}\n",
+        "b.trlc": "package B\nT b1 {\n  x = 1\n}\n",
+    }
+
+    def setUp(self):
+        # pylint: disable=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        for file_name, content in self.FILES.items():
+            self.write(file_name, content)
+        self.ls = self.create_server()
+        self.ls.validate()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, file_name):
+        return os.path.join(self.directory.name, file_name)
+
+    def write(self, file_name, content):
+        with open(self.path(file_name), "w", encoding="UTF-8") as fd:
+            fd.write(content)
+
+    def create_server(self):
+        ls = TrlcLanguageServer("trlc-test", "v0")
+        ls.protocol.set_writer(Null_Writer())
+        uri = path_to_uri(self.directory.name)
+        for _ in ls.protocol.lsp_initialize(InitializeParams(
+                capabilities=ClientCapabilities(),
+                root_uri=uri,
+                workspace_folders=[WorkspaceFolder(uri=uri, name="test")])):
+            pass
+        ls.token_cache = Token_Cache()
+        ls.lexer_pool.token_cache = ls.token_cache
+        ls.apply_config({"parsing": "full", "verify": False})
+        return ls
+
+    @staticmethod
+    def packages(ls):
+        return {key: sorted(entity.symbols.table)
+                for key, entity in ls.snapshot.symbols.table.items()
+                if isinstance(entity, Package)}
+
+    def edit_b(self):
+        """Edit b.trlc in the editor and parse incrementally."""
+        self.ls.fh.update_files(path_to_uri(self.path("b.trlc")),
+                                "package B\nT b2 {\n  x = 2\n}\n")
+        self.ls.validate({self.path("b.trlc")})
+
+    def assert_same_as_full_parse(self):
+        full = self.create_server()
+        full.fh = self.ls.fh
+        full.validate()
+        self.assertEqual(self.packages(self.ls), self.packages(full))
+
+    def files_reused(self):
+        return self.ls.get_stats()["recent_parses"][-1]["files_reused"]
+
+    def test_unchanged_on_disk(self):
+        self.edit_b()
+        self.assertEqual(self.files_reused(), 2)
+        self.assertEqual(self.packages(self.ls)["b"], ["b2", "t"])
+        self.assert_same_as_full_parse()
+
+    def test_changed_on_disk(self):
+        self.write("a.trlc", "package A\nT a1 {\n  x = 1\n}\n"
+                             "T a2 {\n  x = 2\n}\n")
+        self.edit_b()
+        self.assertEqual(self.packages(self.ls)["a"], ["a1", "a2", "t"])
+        self.assert_same_as_full_parse()
+
+    def test_deleted_on_disk(self):
+        os.remove(self.path("a.trlc"))
+        self.edit_b()
+        self.assertEqual(self.packages(self.ls)["a"], ["t"])
+        self.assertNotIn(self.path("a.trlc"), self.ls.snapshot.all_files)
+        self.assert_same_as_full_parse()
+
+    def reparse(self):
+        """Queue a parse of unchanged inputs, e.g. after a configuration
+        change, and run the validator thread's loop once."""
+        with self.ls.queue_lock:
+            self.ls.queue[None] = ("reparse", None)
+        self.ls.validator.validate()
+
+    def test_reparse_without_file_events(self):
+        self.write("a.trlc", "package A\nT a1 {\n  x = 1\n}\n"
+                             "T a2 {\n  x = 2\n}\n")
+        self.reparse()
+        self.assertEqual(self.packages(self.ls)["a"], ["a1", "a2", "t"])
+
+    def test_reparse_skipped_with_file_events(self):
+        self.ls.watching_files = True
+        self.reparse()
+        self.assertEqual(self.ls.get_stats()["counters"]["parses_skipped"],
+                         1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Tests of the per-parse lookup structures."""
+
+import os
+import tempfile
+import unittest
+
+from trlc.errors import Message_Handler
+from trlc.trlc import Source_Manager
+
+from trlc_lsp.indexes import Symbol_Index
+
+
+def parse(files):
+    """Parse the given dict of file names and contents with TRLC and
+    return the symbol table."""
+    with tempfile.TemporaryDirectory() as directory:
+        sm = Source_Manager(Message_Handler())
+        for file_name, content in files.items():
+            path = os.path.join(directory, file_name)
+            with open(path, "w", encoding="UTF-8") as fd:
+                fd.write(content)
+            sm.register_file(path)
+        return sm.process()
+
+
+class Test_Symbol_Index(unittest.TestCase):
+
+    def search(self, files, query, limit=10):
+        index = Symbol_Index().updated(parse(files))
+        return [name for name, _, _ in index.search(query, limit)]
+
+    def test_name_starting_with_and_containing_query(self):
+        # Found by the names starting with the query and again by the
+        # names containing it
+        self.assertEqual(
+            self.search({"a.rsl": "package A\n"
+                                  "type Abcabc {\n  x Integer\n}\n"},
+                        "abc"),
+            ["Abcabc"])
+
+    def test_best_of_many_matches(self):
+        # The shortest names come first, however many names match
+        objects = "".join("T Abcdef_%u {}\n" % n for n in range(3000))
+        self.assertEqual(
+            self.search({"a.rsl": "package A\ntype T {}\n",
+                         "a.trlc": "package A\n" + objects + "T Abx {}\n"},
+                        "ab", 3),
+            ["Abx", "Abcdef_0", "Abcdef_1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Tests of the semantic tokens requests."""
+
+import unittest
+from unittest import mock
+
+from lsprotocol.types import (ClientCapabilities, InitializeParams,
+                              SemanticTokensParams,
+                              TextDocumentContentChangeWholeDocument,
+                              TextDocumentIdentifier, TextDocumentItem,
+                              VersionedTextDocumentIdentifier)
+
+from trlc_lsp import server
+
+
+class Null_Writer:
+    """Stands in for the connection to the client."""
+
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class Test_Semantic_Tokens(unittest.TestCase):
+
+    URI = "file:///unparsed/a.trlc"
+
+    def setUp(self):
+        self.ls = server.TrlcLanguageServer("trlc-test", "v0")
+        self.ls.protocol.set_writer(Null_Writer())
+        for _ in self.ls.protocol.lsp_initialize(InitializeParams(
+                capabilities=ClientCapabilities())):
+            pass
+        self.ls.workspace.put_text_document(TextDocumentItem(
+            uri=self.URI, language_id="trlc", version=1,
+            text="package A\nT a1 {\n  x = 1\n}\n"))
+
+    def request(self):
+        params = SemanticTokensParams(
+            text_document=TextDocumentIdentifier(uri=self.URI))
+        # The fallback indexes the tokens of every document it lexes
+        with mock.patch.object(server, "Token_Index",
+                               wraps=server.Token_Index) as token_index:
+            result = server.semantic_tokens(self.ls, params)
+        return result, token_index.call_count
+
+    def test_unparsed_document_lexed_once_per_version(self):
+        first, lexed = self.request()
+        self.assertEqual(lexed, 1)
+        second, lexed = self.request()
+        self.assertEqual(lexed, 0)
+        self.assertEqual(second.result_id, first.result_id)
+
+        self.ls.workspace.update_text_document(
+            VersionedTextDocumentIdentifier(uri=self.URI, version=2),
+            TextDocumentContentChangeWholeDocument(
+                text="package A\nT a2 {\n  x = 2\n}\n"))
+        third, lexed = self.request()
+        self.assertEqual(lexed, 1)
+        self.assertNotEqual(third.result_id, first.result_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -36,10 +36,6 @@ import tempfile
 # logging.basicConfig(
 #     filename=os.path.join(tempfile.gettempdir(), "pygls.log"),
 #     level=logging.DEBUG, filemode="w")
-logging.basicConfig(
-    filename=os.path.join(tempfile.gettempdir(), "pygls.log"),
-    level=logging.WARNING,
-    filemode="w")
 
 # All extension dependencies are installed into a python-deps/ directory
 # next to this package.  Locate it relative to __file__ so it works
@@ -54,8 +50,6 @@ if os.path.isdir(_python_deps):
     else:
         sys.path.insert(1, _python_deps)
 
-from .server import trlc_server
-
 
 def add_arguments(parser):
     parser.description = "TRLC Language Server"
@@ -76,6 +70,46 @@ def add_arguments(parser):
                         type=int,
                         default=5678,
                         help="Bind to this port")
+    parser.add_argument("--record",
+                        metavar="FILE",
+                        help="Record the messages of the session to FILE,"
+                             " for benchmarks/replay_session.py")
+    parser.add_argument("--startup-report",
+                        action="store_true",
+                        help="Measure the startup of the server, print where"
+                             " the time goes, and exit")
+
+    check = parser.add_argument_group(
+        "check mode",
+        "Check a workspace without editor, as the server does in full"
+        " parsing mode, and report the diagnostics. Exits with 1 if there"
+        " are errors.")
+    check.add_argument("--check",
+                       action="append",
+                       metavar="DIR",
+                       help="Check the files below DIR (can be given more"
+                            " than once) instead of starting the server")
+    check.add_argument("--format",
+                       choices=["json", "sarif"],
+                       default="json",
+                       help="Report format (default: json)")
+    check.add_argument("--output",
+                       metavar="FILE",
+                       help="Write the report to FILE instead of stdout")
+    check.add_argument("--exclude",
+                       action="append",
+                       metavar="REGEX",
+                       help="Exclude directories whose name matches REGEX,"
+                            " like trlcServer.excludePatterns")
+    check.add_argument("--no-verify",
+                       action="store_true",
+                       help="Do not verify checks with CVC5, like"
+                            " trlcServer.verify = false")
+    check.add_argument("--jobs",
+                       type=int,
+                       default=0,
+                       help="Number of worker processes for lexing and"
+                            " verification (default: one per CPU core)")
 
 
 def main():
@@ -83,6 +117,29 @@ def main():
     add_arguments(parser)
     args = parser.parse_args()
 
+    if args.startup_report:
+        from .startup import report  # pylint: disable=C0415
+        sys.exit(report())
+
+    if args.check:
+        # The log of a running server must not be truncated
+        logging.basicConfig(level=logging.WARNING)
+        from .check import run  # pylint: disable=C0415
+        sys.exit(run(args.check, args.format, args.output, args.exclude,
+                     not args.no_verify, max(args.jobs, 0)))
+
+    # This module is also imported by the verification worker processes,
+    # which must neither truncate the log nor start a server.
+    logging.basicConfig(
+        filename=os.path.join(tempfile.gettempdir(), "pygls.log"),
+        level=logging.WARNING,
+        filemode="w")
+    from .server import trlc_server  # pylint: disable=C0415
+
+    if args.record:
+        from .recording import Session_Recorder  # pylint: disable=C0415
+        Session_Recorder(args.record).attach(trlc_server.protocol)
+
     if args.tcp:
         trlc_server.start_tcp(args.host, args.port)
     elif args.ws:
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Caches that persist across parses and server restarts."""
+
+import hashlib
+import json
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+
+from trlc.lexer import Source_Reference, Token, Token_Stream
+from trlc.version import TRLC_VERSION
+
+LOGGER = logging.getLogger()
+
+
+def get_cache_dir():
+    """Return the per-user cache directory of the language server."""
+    if sys.platform.startswith("win32"):
+        base = os.environ.get("LOCALAPPDATA") or tempfile.gettempdir()
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = (os.environ.get("XDG_CACHE_HOME") or
+                os.path.expanduser("~/.cache"))
+    return os.path.join(base, "trlc-lsp")
+
+
+def _encode_value(value):
+    if isinstance(value, Fraction):
+        return {"__fraction__": [value.numerator, value.denominator]}
+    raise TypeError(type(value).__name__)
+
+
+def _decode_value(obj):
+    if set(obj) == {"__fraction__"}:
+        return Fraction(*obj["__fraction__"])
+    return obj
+
+
+class Verification_Cache:
+    """Content-addressed cache of CVC5 results.
+
+    Each verification condition generated by TRLC's VCG is rendered to
+    SMTLIB and hashed, without comments (they contain source locations).
+    The script encodes the checks on a type along with everything they
+    depend on, so an unchanged hash means an unchanged solver result.
+
+    The cache is kept in memory with least-recently-used eviction, and is
+    loaded from and saved to a JSON file so that it survives restarts.
+    """
+
+    MAX_ENTRIES = 20000
+
+    def __init__(self, file_name=None, max_entries=MAX_ENTRIES):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Results are also stored from the callbacks of worker processes
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self.loaded = False
+
+    def load(self):
+        """Load the entries saved to the file, unless done before. Called on
+        first use: the version of the cache imports CVC5, and the file may
+        be large."""
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            self.version = "%s/%s" % (TRLC_VERSION, _solver_version())
+            if not self.file_name:
+                return
+            try:
+                with open(self.file_name, "r", encoding="UTF-8") as fd:
+                    data = json.load(fd, object_hook=_decode_value)
+            except (OSError, ValueError):
+                return
+            if data.get("version") != self.version:
+                return
+            for key, (status, values) in data.get("entries", []):
+                self.entries[key] = (status, values)
+
+    def save(self):
+        self.load()
+        with self.lock:
+            if not (self.file_name and self.dirty):
+                return
+            data = {"version": self.version,
+                    "entries": [[key, list(result)]
+                                for key, result in self.entries.items()]}
+            self.dirty = False
+        tmp_name = "%s.%u.tmp" % (self.file_name, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            with open(tmp_name, "w", encoding="UTF-8") as fd:
+                json.dump(data, fd, default=_encode_value)
+            os.replace(tmp_name, self.file_name)
+        except (OSError, TypeError):
+            LOGGER.warning("TRLC: Unable to write %s", self.file_name,
+                           exc_info=True)
+
+    @staticmethod
+    def key(script, options):
+        digest = hashlib.sha256()
+        for name, value in sorted(options.items()):
+            digest.update(("%s=%s\n" % (name, value)).encode("UTF-8"))
+        for line in script.splitlines():
+            if not line.startswith(";;"):
+                digest.update(line.encode("UTF-8") + b"\n")
+        return digest.hexdigest()
+
+    def get(self, key):
+        self.load()
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return result
+
+    def put(self, key, status, values):
+        # Timeouts depend on machine load, so only definite answers are
+        # worth remembering.
+        if status == "unknown":
+            return
+        self.load()
+        with self.lock:
+            self.entries[key] = (status, values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+
+def _solver_version():
+    try:
+        import cvc5  # pylint: disable=import-outside-toplevel
+        return getattr(cvc5, "__version__", "cvc5")
+    except ImportError:  # pragma: no cover
+        return "none"
+
+
+class Token_Cache:
+    """Persistent cache of the token streams of lexed files.
+
+    Every file gets its own entry in the cache directory, named after a
+    hash of its path, so that storing the tokens of an edited file does
+    not rewrite the whole cache. An entry is only used if the size,
+    modification time and content hash of the file are unchanged.
+
+    Tokens are stored as plain tuples with marshal, whose format depends
+    on the Python version, so entries written by other Python or TRLC
+    versions are ignored.
+
+    The directory is limited to max_entries files: every EVICT_INTERVAL
+    stores, the least recently used entries are removed. Entries are
+    touched when they are used, so their modification time tells when
+    they were last used.
+    """
+
+    MAX_ENTRIES = 20000
+    EVICT_INTERVAL = 500
+
+    def __init__(self, directory=None, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.version = "%s/%s" % (TRLC_VERSION, sys.version)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def entry_name(self, file_name):
+        digest = hashlib.sha1(os.path.abspath(file_name).encode("UTF-8"))
+        return os.path.join(self.directory, digest.hexdigest() + ".bin")
+
+    @staticmethod
+    def stamp(file_name, content, from_disk):
+        """Return the stamp identifying the given content of a file. The
+        modification time is only part of it if the content was read
+        from disk."""
+        digest = hashlib.sha1(content.encode("UTF-8")).hexdigest()
+        if not from_disk:
+            return (len(content), None, digest)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns, digest)
+
+    def get(self, file_name, stamp):
+        """Return the cached tokens of the file, or None."""
+        tokens = None
+        if self.directory and stamp:
+            entry_name = self.entry_name(file_name)
+            try:
+                with open(entry_name, "rb") as fd:
+                    # Much faster than reading through marshal.load
+                    data = fd.read()
+                version, entry_stamp, entry_tokens = marshal.loads(data)
+                if version == self.version and entry_stamp == stamp:
+                    tokens = entry_tokens
+                    os.utime(entry_name)
+            except (OSError, ValueError, EOFError, TypeError):
+                pass
+        if tokens is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return tokens
+
+    def put(self, file_name, stamp, tokens):
+        if not (self.directory and stamp):
+            return
+        entry_name = self.entry_name(file_name)
+        tmp_name = "%s.%u.tmp" % (entry_name, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_name, "wb") as fd:
+                fd.write(marshal.dumps((self.version, stamp, tokens)))
+            os.replace(tmp_name, entry_name)
+        except (OSError, ValueError):
+            LOGGER.warning("TRLC: Unable to write %s", entry_name,
+                           exc_info=True)
+            return
+        # The first store of a process checks the directory too, as the
+        # entries of earlier sessions count against the limit.
+        if self.stores % self.EVICT_INTERVAL == 0:
+            self.evict()
+        self.stores += 1
+
+    def evict(self):
+        """Remove the least recently used entries beyond max_entries."""
+        try:
+            entries = sorted((entry.stat().st_mtime_ns, entry.path)
+                             for entry in os.scandir(self.directory)
+                             if entry.name.endswith(".bin"))
+        except OSError:
+            return
+        if len(entries) <= self.max_entries:
+            return
+        for _, entry_name in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(entry_name)
+            except OSError:
+                pass
+
+
+def encode_tokens(tokens):
+    """Convert tokens to tuples of builtin types, as stored in the
+    Token_Cache."""
+    result = []
+    for tok in tokens:
+        value = tok.value
+        if tok.kind == "DECIMAL":
+            value = (value.numerator, value.denominator)
+        loc = tok.location
+        result.append((tok.kind, value, loc.line_no, loc.col_no,
+                       loc.start_pos, loc.end_pos))
+    return result
+
+
+class Cached_Token_Stream(Token_Stream):
+    """Token stream replaying the tokens of a file from the Token_Cache
+    instead of lexing its content."""
+
+    def __init__(self, mh, file_name, file_content, cached_tokens):
+        super().__init__(mh, file_name, file_content)
+        self.cached_tokens = cached_tokens
+        self.next_token = 0
+
+    def token(self):
+        if self.next_token >= len(self.cached_tokens):
+            return None
+        kind, value, line_no, col_no, start_pos, end_pos = \
+            self.cached_tokens[self.next_token]
+        self.next_token += 1
+        if kind == "DECIMAL":
+            value = Fraction(*value)
+
+        # The tokens were checked when they were lexed, so the (costly)
+        # assertions in the constructors are skipped.
+        loc = Source_Reference.__new__(Source_Reference)
+        loc.file_name = self.file_name
+        loc.line_no = line_no
+        loc.col_no = col_no
+        loc.lexer = self
+        loc.start_pos = start_pos
+        loc.end_pos = end_pos
+        tok = Token.__new__(Token)
+        tok.location = loc
+        tok.kind = kind
+        tok.value = value
+        tok.ast_link = None
+
+        self.tokens.append(tok)
+        return tok
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Headless check of a workspace, for CI: runs the parse of the language
+server without an editor and reports the diagnostics as JSON or SARIF."""
+
+import json
+import os
+import sys
+import time
+
+from lsprotocol.types import DiagnosticSeverity
+from trlc.version import TRLC_VERSION
+
+from .cache import Token_Cache, Verification_Cache, get_cache_dir
+from .lexing import Lexer_Pool
+from .source_manager import Vscode_Source_Manager
+from .trlc_utils import File_Handler, Vscode_Message_Handler, path_to_uri
+from .verify import Verifier
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+SEVERITY_NAMES = {
+    DiagnosticSeverity.Error: "error",
+    DiagnosticSeverity.Warning: "warning",
+    DiagnosticSeverity.Information: "information",
+    DiagnosticSeverity.Hint: "hint",
+}
+
+SARIF_LEVELS = {
+    DiagnosticSeverity.Error: "error",
+    DiagnosticSeverity.Warning: "warning",
+    DiagnosticSeverity.Information: "note",
+    DiagnosticSeverity.Hint: "note",
+}
+
+
+class Headless_Progress:
+    """Stands in for the work done progress of a client."""
+
+    def __init__(self):
+        self.tokens = {}
+
+    def create(self, token):
+        pass
+
+    def begin(self, token, value):
+        pass
+
+    def report(self, token, value):
+        pass
+
+    def end(self, token, value):
+        pass
+
+
+class Headless_Client:
+    """Stands in for the language server, as far as the source manager
+    is concerned."""
+
+    def __init__(self):
+        self.work_done_progress = Headless_Progress()
+
+
+def check(directories, exclude_patterns=None, verify=True, workers=0):
+    """Parse all .rsl and .trlc files below the given directories like the
+    language server does in full parsing mode, using the same caches.
+
+    Returns the diagnostics, as a dict of (file name, list of LSP
+    diagnostics), the number of files and the seconds spent per phase.
+    """
+    start = time.perf_counter()
+    vmh = Vscode_Message_Handler()
+    token_cache = Token_Cache(os.path.join(get_cache_dir(), "tokens"))
+    lexer_pool = Lexer_Pool(token_cache)
+    lexer_pool.set_workers(workers)
+    vsm = Vscode_Source_Manager(vmh, File_Handler(), Headless_Client(),
+                                verify_mode=False,
+                                exclude_patterns=exclude_patterns,
+                                token_cache=token_cache,
+                                lexer_pool=lexer_pool)
+    for directory in directories:
+        vsm.register_workspace(os.path.abspath(directory))
+    vsm.process()
+    timings = dict(vsm.timings)
+    timings["parse"] = time.perf_counter() - start
+
+    diagnostics = {uri: list(file_diagnostics)
+                   for uri, file_diagnostics in vmh.diagnostics.items()}
+
+    if verify and vsm.verify_ready:
+        start = time.perf_counter()
+        verify_cache = Verification_Cache(
+            os.path.join(get_cache_dir(), "verification.json"))
+        verifier = Verifier(verify_cache)
+        verifier.set_workers(workers)
+
+        def publish(findings):
+            for uri, file_diagnostics in findings.items():
+                diagnostics.setdefault(uri, []).extend(file_diagnostics)
+
+        verifier.verify(vsm.stab, publish, lambda: False)
+        verify_cache.save()
+        if verifier.pool is not None:
+            verifier.pool.shutdown()
+        timings["verify"] = time.perf_counter() - start
+
+    if lexer_pool.pool is not None:
+        lexer_pool.pool.shutdown()
+    file_names = {path_to_uri(file_name): file_name
+                  for file_name in vsm.all_files}
+    return ({file_names.get(uri, uri): file_diagnostics
+             for uri, file_diagnostics in diagnostics.items()},
+            len(vsm.all_files), timings)
+
+
+def relative_name(file_name):
+    """Return file_name relative to the working directory, as reported,
+    unless it is outside of it."""
+    try:
+        rel_name = os.path.relpath(file_name)
+    except ValueError:
+        # On another drive
+        return file_name
+    if rel_name.startswith(os.pardir):
+        return file_name
+    return rel_name.replace("\\", "/")
+
+
+def get_summary(diagnostics):
+    summary = {name: 0 for name in SEVERITY_NAMES.values()}
+    for file_diagnostics in diagnostics.values():
+        for diagnostic in file_diagnostics:
+            summary[SEVERITY_NAMES.get(diagnostic.severity, "error")] += 1
+    return summary
+
+
+def to_json(diagnostics, files, timings):
+    """Return the report as JSON compatible dict. Lines and columns start
+    at 1, end columns are exclusive."""
+    return {
+        "trlc": TRLC_VERSION,
+        "files": files,
+        "summary": get_summary(diagnostics),
+        "timings_ms": {phase: round(seconds * 1000, 3)
+                       for phase, seconds in timings.items()},
+        "diagnostics": [
+            {"file": relative_name(file_name),
+             "line": diagnostic.range.start.line + 1,
+             "column": diagnostic.range.start.character + 1,
+             "end_line": diagnostic.range.end.line + 1,
+             "end_column": diagnostic.range.end.character + 1,
+             "severity": SEVERITY_NAMES.get(diagnostic.severity, "error"),
+             "code": diagnostic.code,
+             "message": diagnostic.message}
+            for file_name in sorted(diagnostics)
+            for diagnostic in diagnostics[file_name]
+        ],
+    }
+
+
+def to_sarif(diagnostics, files, timings):
+    """Return the report as SARIF 2.1.0 log. Files in the working directory
+    are given relative to SRCROOT, which is the working directory."""
+    results = []
+    for file_name in sorted(diagnostics):
+        rel_name = relative_name(file_name)
+        if rel_name == file_name:
+            artifact = {"uri": path_to_uri(file_name)}
+        else:
+            artifact = {"uri": rel_name, "uriBaseId": "SRCROOT"}
+        for diagnostic in diagnostics[file_name]:
+            results.append({
+                "ruleId": diagnostic.code or "trlc",
+                "level": SARIF_LEVELS.get(diagnostic.severity, "error"),
+                "message": {"text": diagnostic.message},
+                "locations": [{"physicalLocation": {
+                    "artifactLocation": artifact,
+                    "region": {
+                        "startLine": diagnostic.range.start.line + 1,
+                        "startColumn": diagnostic.range.start.character + 1,
+                        "endLine": diagnostic.range.end.line + 1,
+                        "endColumn": diagnostic.range.end.character + 1,
+                    }}}],
+            })
+    rules = sorted({result["ruleId"] for result in results})
+    return {
+        "$schema": SARIF_SCHEMA,
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {
+                "name": "TRLC",
+                "version": TRLC_VERSION,
+                "informationUri":
+                    "https://github.com/bmw-software-engineering/trlc",
+                "rules": [{"id": rule} for rule in rules],
+            }},
+            "originalUriBaseIds": {
+                "SRCROOT": {"uri": path_to_uri(os.getcwd()).rstrip("/") + "/"}
+            },
+            "results": results,
+            "properties": {
+                "files": files,
+                "timings_ms": {phase: round(seconds * 1000, 3)
+                               for phase, seconds in timings.items()},
+            },
+        }],
+    }
+
+
+def run(directories, output_format="json",  # pylint: disable=R0917
+        output=None, exclude_patterns=None, verify=True, workers=0):
+    """Check the directories and write the report to output, or stdout.
+    Returns the exit code: 1 if there are errors, 0 otherwise."""
+    start = time.perf_counter()
+    diagnostics, files, timings = check(directories, exclude_patterns,
+                                        verify, workers)
+    timings["total"] = time.perf_counter() - start
+    if output_format == "sarif":
+        report = to_sarif(diagnostics, files, timings)
+    else:
+        report = to_json(diagnostics, files, timings)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="UTF-8") as fd:
+            fd.write(text + "\n")
+    else:
+        print(text)
+
+    summary = get_summary(diagnostics)
+    print("Processed %u files: %u error(s), %u warning(s) in %.2f s" %
+          (files, summary["error"], summary["warning"], timings["total"]),
+          file=sys.stderr)
+    return 1 if summary["error"] else 0
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Lookup structures built by the validator thread once per parse, so
+that request handlers do not have to scan token streams or the AST."""
+
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import count
+
+from trlc.ast import (Builtin_Function, Builtin_Type, Enumeration_Type,
+                      Package, Record_Object, Record_Type, Symbol_Table,
+                      Tuple_Type)
+
+from .trlc_utils import get_ast_entity
+
+
+def _key(line, col):
+    return (line << 32) | col
+
+
+class Token_Index:
+    """Position index over the token stream of one file.
+
+    Token start and end positions are stored in flat integer arrays using
+    zero-based lines and columns, as used by the LSP. The token at a
+    position is found by bisection over the start positions.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.starts = array("q")
+        self.ends = array("q")
+        for tok in tokens:
+            loc = tok.location
+            start_line = loc.line_no - 1
+            start_col = loc.col_no - 1
+            content = loc.lexer.content
+            if content.find("\n", loc.start_pos, loc.end_pos + 1) < 0:
+                end_line = start_line
+                end_col = start_col + loc.end_pos - loc.start_pos + 1
+            else:
+                end_loc = loc.get_end_location()
+                end_line = end_loc.line_no - 1
+                end_col = end_loc.col_no
+            self.starts.append(_key(start_line, start_col))
+            self.ends.append(_key(end_line, end_col))
+
+    def find(self, line, col, greedy=False):
+        """Return the index of the token at the given position, or -1.
+
+        If greedy is set and the position does not refer to a token (e.g.
+        it is whitespace) the closest preceding token on the same line is
+        returned instead.
+        """
+        if line < 0 or col < 0:
+            return -1
+        pos = _key(line, col)
+        n = bisect_right(self.starts, pos) - 1
+        if n < 0:
+            return -1
+        if pos < self.ends[n]:
+            return n
+        if greedy and self.ends[n] >> 32 == line:
+            return n
+        return -1
+
+    def token(self, n):
+        """Return the token with the given index, or None if out of
+        range."""
+        if 0 <= n < len(self.tokens):
+            return self.tokens[n]
+        return None
+
+    def is_multi_line(self, n):
+        return self.starts[n] >> 32 != self.ends[n] >> 32
+
+    def span(self, start_line, start_col, end_line, end_col):
+        """Return the range of indexes of the tokens starting in the given
+        range of positions (end exclusive)."""
+        return range(bisect_left(self.starts, _key(start_line, start_col)),
+                     bisect_left(self.starts, _key(end_line, end_col)))
+
+
+class Reference_Index:
+    """Reverse index from AST entities to the identifier tokens referring
+    to them, across all parsed files.
+
+    The index is kept per file, so that after an incremental parse only the
+    files that were parsed again have to be indexed again. An index is not
+    changed once built: updated returns a new one, sharing what did not
+    change, so that handlers can go on reading the previous one.
+    """
+
+    def __init__(self):
+        self.entities = {}
+        self.files = {}
+
+    def updated(self, all_files, parsed_files):
+        """Return a new index without the files that are gone or were parsed
+        again, and with the given parsed files."""
+        index = Reference_Index()
+        index.entities = dict(self.entities)
+        index.files = dict(self.files)
+        # Entities whose references per file were copied from this index
+        owned = set()
+        for file_name in self.files:
+            if file_name in parsed_files or file_name not in all_files:
+                index.remove_file(file_name, owned)
+        for file_name in parsed_files:
+            index.add_file(file_name, all_files[file_name].lexer.tokens,
+                           owned)
+        return index
+
+    def file_refs(self, entity, owned):
+        """Return the references to entity per file, to be changed. Unless
+        entity is in owned, they are shared with the previous index and
+        copied first."""
+        if entity not in owned:
+            owned.add(entity)
+            self.entities[entity] = dict(self.entities.get(entity, ()))
+        return self.entities[entity]
+
+    def add_file(self, file_name, tokens, owned):
+        file_refs = {}
+        for tok in tokens:
+            if tok.kind != "IDENTIFIER" or tok.ast_link is None:
+                continue
+            entity = get_ast_entity(tok)
+            if entity is None or isinstance(entity, (Builtin_Type,
+                                                     Builtin_Function)):
+                continue
+            if entity in file_refs:
+                file_refs[entity].append(tok)
+            else:
+                file_refs[entity] = [tok]
+        for entity, refs in file_refs.items():
+            self.file_refs(entity, owned)[file_name] = refs
+        self.files[file_name] = file_refs
+
+    def remove_file(self, file_name, owned):
+        for entity in self.files.pop(file_name, ()):
+            refs = self.file_refs(entity, owned)
+            del refs[file_name]
+            if not refs:
+                del self.entities[entity]
+                owned.discard(entity)
+
+    def references(self, entity):
+        """Return the identifier tokens referring to the given entity, as
+        one list per file."""
+        return list(self.entities.get(entity, {}).values())
+
+
+class Sorted_Labels:
+    """Completion labels, sorted case-insensitively so that the labels
+    starting with a prefix are found by bisection."""
+
+    def __init__(self, labels):
+        self.labels = sorted(labels, key=str.lower)
+        self.keys = [label.lower() for label in self.labels]
+
+    def matching(self, prefix=""):
+        """Return the labels starting with prefix, ignoring case."""
+        if not prefix:
+            return self.labels
+        prefix = prefix.lower()
+        return self.labels[bisect_left(self.keys, prefix):
+                           bisect_left(self.keys, prefix + "\U0010ffff")]
+
+
+class Package_Completions:
+    """The completion candidates declared in one package."""
+
+    def __init__(self, package):
+        types = []
+        objects = {}
+        self.literals = {}
+        self.qualified_literals = {}
+        self.components = {}
+        self.skeletons = {}
+        for entity in package.symbols.table.values():
+            if isinstance(entity, Record_Object):
+                # An object is a candidate for references to its type and
+                # to all types it extends
+                typ = entity.n_typ
+                while typ is not None:
+                    objects.setdefault(typ, []).append(entity.name)
+                    typ = typ.parent
+                continue
+            types.append(entity.name)
+            if isinstance(entity, Enumeration_Type):
+                literals = Sorted_Labels(
+                    literal.name
+                    for literal in entity.literals.table.values())
+                self.literals[entity] = literals
+                self.qualified_literals[entity] = (
+                    Sorted_Labels("%s.%s" % (entity.name, label)
+                                  for label in literals.labels),
+                    Sorted_Labels("%s.%s.%s" % (package.name, entity.name,
+                                                label)
+                                  for label in literals.labels))
+            elif isinstance(entity, Tuple_Type):
+                self.components[entity] = Sorted_Labels(
+                    component.name
+                    for component in entity.components.table.values())
+            elif isinstance(entity, Record_Type):
+                self.skeletons[entity] = "".join(
+                    "\n    %s =" % name
+                    for name, component in entity.components.table.items()
+                    if component.optional is False) + "\n"
+        self.types = Sorted_Labels(types)
+        self.objects = {typ: Sorted_Labels(names)
+                        for typ, names in objects.items()}
+
+
+class Completion_Index:
+    """Completion candidates of all packages, sorted by label.
+
+    Built by the validator thread once per parse, so that completion only
+    looks up and filters the candidates. The candidates of packages reused
+    by an incremental parse are carried over from the previous index.
+    """
+
+    def __init__(self, symbols, previous=None):
+        self.packages = {}
+        self.by_name = {}
+        for entity in symbols.table.values():
+            if not isinstance(entity, Package):
+                continue
+            self.by_name[entity.name] = entity
+            if previous is not None and entity in previous.packages:
+                self.packages[entity] = previous.packages[entity]
+            else:
+                self.packages[entity] = Package_Completions(entity)
+        self.package_names = Sorted_Labels(self.by_name)
+
+    def of_package(self, package):
+        """Return the candidates of the given package, also if it was not
+        part of the parse (e.g. a package of a Name_Reference)."""
+        if package not in self.packages:
+            return Package_Completions(package)
+        return self.packages[package]
+
+    def types(self, package):
+        return self.of_package(package).types
+
+    def objects(self, typ):
+        """Return the record objects of the package of typ that are of typ
+        or a type extending it."""
+        return self.of_package(typ.n_package).objects.get(
+            typ, Sorted_Labels(()))
+
+    def literals(self, enum):
+        return self.of_package(enum.n_package).literals[enum]
+
+    def qualified_literals(self, enum, with_package):
+        """Return the literals of enum qualified by its name and, if
+        with_package is set, also by the name of its package."""
+        completions = self.of_package(enum.n_package)
+        local, foreign = completions.qualified_literals[enum]
+        return foreign if with_package else local
+
+    def components(self, typ):
+        return self.of_package(typ.n_package).components[typ]
+
+    def skeleton(self, typ):
+        return self.of_package(typ.n_package).skeletons[typ]
+
+    def lookup(self, path):
+        """Return the entity with the given path of names (package, entity
+        in the package, literal or component), or None."""
+        entity = self.by_name.get(path[0]) if path else None
+        for name in path[1:]:
+            if isinstance(entity, Package):
+                table = entity.symbols
+            elif isinstance(entity, Enumeration_Type):
+                table = entity.literals
+            elif isinstance(entity, Tuple_Type):
+                table = entity.components
+            else:
+                return None
+            entity = table.table.get(Symbol_Table.simplified_name(name))
+        return entity
+
+
+def _trigrams(key):
+    """Return the trigrams of key, including the two that mark its start,
+    so that names can be found by their first one or two characters."""
+    padded = "\0\0" + key
+    return {padded[n:n + 3] for n in range(len(padded) - 2)}
+
+
+def _package_symbols(package):
+    """Yield the (name, entity, container name) of the packages, types,
+    enumeration literals and record objects of package."""
+    yield package.name, package, ""
+    for entity in package.symbols.table.values():
+        yield entity.name, entity, package.name
+        if isinstance(entity, Enumeration_Type):
+            container = "%s.%s" % (package.name, entity.name)
+            for literal in entity.literals.table.values():
+                yield literal.name, literal, container
+
+
+def _owned_ids(table, key, owned):
+    """Return the set of symbol ids under key in table, to be changed.
+    Unless key is in owned, the set is shared with the previous index and
+    copied first."""
+    if key not in owned:
+        owned.add(key)
+        table[key] = set(table.get(key, ()))
+    return table[key]
+
+
+def _discard_id(table, key, owned, symbol_id):
+    ids = _owned_ids(table, key, owned)
+    ids.discard(symbol_id)
+    if not ids:
+        del table[key]
+        owned.discard(key)
+
+
+class Symbol_Index:
+    """Trigram index over the names of all symbols, for workspace/symbol.
+
+    Names are compared like TRLC does to find names that are too similar:
+    in lower case and without underscores. Every symbol is listed under the
+    trigrams of its name. Names containing the query are found by
+    intersecting the sets of the trigrams of the query; if these are not
+    enough, names sharing at least half of them are added. The symbols are
+    kept per package, so that after an incremental parse only the packages
+    that were parsed again are indexed again. Like the Reference_Index, an
+    index is not changed once built.
+    """
+
+    def __init__(self):
+        self.ids = count()
+        self.symbols = {}
+        self.names = {}
+        self.packages = {}
+        self.trigrams = {}
+
+    def updated(self, symbols):
+        """Return a new index without the packages that are gone or were
+        parsed again, and with the packages of symbols not indexed yet.
+        Packages reused by an incremental parse are the same objects and
+        stay indexed. This index is not changed."""
+        index = Symbol_Index()
+        index.ids = self.ids
+        index.symbols = dict(self.symbols)
+        index.names = dict(self.names)
+        index.packages = dict(self.packages)
+        index.trigrams = dict(self.trigrams)
+        # Keys of names and trigrams whose sets were copied from this index
+        owned = (set(), set())
+        packages = {entity for entity in symbols.table.values()
+                    if isinstance(entity, Package)}
+        for package in self.packages:
+            if package not in packages:
+                index.remove_package(package, owned)
+        for package in packages:
+            if package not in self.packages:
+                index.add_package(package, owned)
+        return index
+
+    def add_package(self, package, owned):
+        owned_names, owned_trigrams = owned
+        ids = []
+        for name, entity, container in _package_symbols(package):
+            symbol_id = next(self.ids)
+            key = Symbol_Table.simplified_name(name)
+            self.symbols[symbol_id] = (key, name, entity, container)
+            _owned_ids(self.names, key, owned_names).add(symbol_id)
+            for trigram in _trigrams(key):
+                _owned_ids(self.trigrams, trigram,
+                           owned_trigrams).add(symbol_id)
+            ids.append(symbol_id)
+        self.packages[package] = ids
+
+    def remove_package(self, package, owned):
+        owned_names, owned_trigrams = owned
+        for symbol_id in self.packages.pop(package):
+            key = self.symbols.pop(symbol_id)[0]
+            _discard_id(self.names, key, owned_names, symbol_id)
+            for trigram in _trigrams(key):
+                _discard_id(self.trigrams, trigram, owned_trigrams,
+                            symbol_id)
+
+    def rank(self, ids, score, limit):
+        """Return the ids of the best limit symbols among ids, given a
+        function returning the score of a name, or None if it does not
+        match. Ties are broken by the length of the name, then the name."""
+        if limit <= 0:
+            return []
+
+        def ranked():
+            for symbol_id in ids:
+                key = self.symbols[symbol_id][0]
+                value = score(key)
+                if value is not None:
+                    yield value, len(key), key, symbol_id
+        return [item[-1] for item in heapq.nsmallest(limit, ranked())]
+
+    def search(self, query, limit):
+        """Return the (name, entity, container name) of at most limit
+        symbols matching query, best first: names equal to it, starting
+        with it, containing it and finally similar names. Queries of one or
+        two characters only match the start of names."""
+        query = Symbol_Table.simplified_name(query)
+        if not query:
+            return []
+        if len(query) < 3:
+            grams = [("\0\0" + query)[-3:]]
+        else:
+            grams = sorted(_trigrams(query) - _trigrams(query[:2]),
+                           key=lambda gram: len(self.trigrams.get(gram, ())))
+        postings = [self.trigrams.get(gram, set()) for gram in grams]
+
+        exact = self.names.get(query, set())
+        found = (postings[0].intersection(*postings[1:])
+                 if len(postings) > 1 else postings[0])
+        # Of one or two characters, all of them start with the query
+        starting = (self.trigrams.get(("\0" + query)[:3], set())
+                    if len(query) > 2 else found)
+        result = self.rank(exact, lambda key: 0, limit)
+        result += self.rank(
+            (symbol_id for symbol_id in found
+             if symbol_id in starting and symbol_id not in exact),
+            lambda key: 0 if key.startswith(query) else None,
+            limit - len(result))
+        if found is not starting:
+            # Names starting with the query may contain it again
+            returned = set(result)
+            result += self.rank(
+                (symbol_id for symbol_id in found
+                 if symbol_id not in exact and symbol_id not in returned),
+                lambda key: key.find(query, 1) if query in key[1:] else None,
+                limit - len(result))
+
+        # A name sharing at least half of the trigrams of the query is in
+        # one of the rarest lists beyond that half
+        if len(result) < limit and len(grams) > 1:
+            required = (len(grams) + 1) // 2
+            similar = set().union(
+                *postings[:len(grams) - required + 1]) - found - exact
+
+            def shared(key):
+                count_shared = sum(gram in key for gram in grams)
+                return -count_shared if count_shared >= required else None
+            result += self.rank(similar, shared, limit - len(result))
+
+        return [self.symbols[symbol_id][1:] for symbol_id in result]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""The TRLC files of the workspace folders, kept between parses."""
+
+import os
+
+TRLC_EXTENSIONS = (".rsl", ".trlc")
+
+
+def _walk_key(rel_path):
+    # Orders files like a sorted top-down os.walk: the files of a directory
+    # come before the contents of its sub-directories.
+    parts = rel_path.split(os.sep)
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+class Workspace_Inventory:
+    """Inventory of the .rsl and .trlc files below the workspace folders.
+
+    Each folder is scanned once, with os.scandir, the first time its files
+    are needed. Afterwards the inventory is kept up to date from file
+    system events (workspace/didChangeWatchedFiles) instead of walking the
+    folder again for every parse. A folder is scanned again if the exclude
+    patterns change, or when it is invalidated.
+
+    The inventory is only used from the validator thread.
+    """
+
+    def __init__(self):
+        self.folders = {}
+        self.ordered = {}
+        self.patterns = []
+        self.scans = 0
+
+    def invalidate(self):
+        """Forget all folders, so they are scanned again."""
+        self.folders = {}
+        self.ordered = {}
+
+    def excluded(self, dir_name):
+        return any(pattern.match(dir_name) for pattern in self.patterns)
+
+    def set_patterns(self, exclude_patterns):
+        """Set the (compiled) patterns of excluded directory names."""
+        if ([pattern.pattern for pattern in exclude_patterns] !=
+                [pattern.pattern for pattern in self.patterns]):
+            self.patterns = list(exclude_patterns)
+            self.invalidate()
+
+    def scan(self, folder):
+        files = set()
+        work_list = [folder]
+        while work_list:
+            dir_name = work_list.pop()
+            try:
+                with os.scandir(dir_name) as entries:
+                    for entry in entries:
+                        # Like os.walk, do not follow links to directories
+                        if entry.is_dir():
+                            if (not entry.is_symlink() and
+                                    not self.excluded(entry.name)):
+                                work_list.append(entry.path)
+                        elif entry.name.endswith(TRLC_EXTENSIONS):
+                            files.add(entry.path)
+            except OSError:
+                continue
+        self.scans += 1
+        self.folders[folder] = files
+        self.ordered.pop(folder, None)
+
+    def files(self, folder):
+        """Return the TRLC files below the given folder, in a stable
+        order."""
+        if folder not in self.folders:
+            self.scan(folder)
+        if folder not in self.ordered:
+            self.ordered[folder] = sorted(
+                self.folders[folder],
+                key=lambda path: _walk_key(os.path.relpath(path, folder)))
+        return self.ordered[folder]
+
+    def relative_path(self, folder, path):
+        """Return the path relative to the folder, or None if it is not
+        inside the folder or inside an excluded directory."""
+        rel_path = os.path.relpath(path, folder)
+        if rel_path == os.curdir or rel_path.startswith(os.pardir):
+            return None
+        if any(self.excluded(part) for part in rel_path.split(os.sep)[:-1]):
+            return None
+        return rel_path
+
+    def file_created(self, path):
+        """Add a created file (or directory). Returns True if the inventory
+        changed."""
+        changed = False
+        for folder, files in self.folders.items():
+            if self.relative_path(folder, path) is None:
+                continue
+            if os.path.isdir(path):
+                # Happens when a directory is moved into the workspace
+                if self.excluded(os.path.basename(path)):
+                    continue
+                added = Workspace_Inventory()
+                added.patterns = self.patterns
+                new_files = set(added.files(path)) - files
+            elif path.endswith(TRLC_EXTENSIONS) and path not in files:
+                new_files = {path}
+            else:
+                continue
+            if new_files:
+                files.update(new_files)
+                self.ordered.pop(folder, None)
+                changed = True
+        return changed
+
+    def file_deleted(self, path):
+        """Remove a deleted file (or directory). Returns True if the
+        inventory changed."""
+        changed = False
+        prefix = os.path.join(path, "")
+        for folder, files in self.folders.items():
+            gone = {file_name for file_name in files
+                    if file_name == path or file_name.startswith(prefix)}
+            if gone:
+                files -= gone
+                self.ordered.pop(folder, None)
+                changed = True
+        return changed
+
+    def __contains__(self, path):
+        return any(path in files for files in self.folders.values())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Lexing of TRLC files in worker processes, ahead of parsing them."""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from trlc.errors import TRLC_Error
+from trlc.lexer import Token_Stream
+
+from .cache import Token_Cache, encode_tokens
+from .trlc_utils import Vscode_Message_Handler
+
+LOGGER = logging.getLogger()
+
+POLL_SECONDS = 0.1
+
+# Below this many files, starting up workers costs more than it saves
+MIN_FILES = 16
+
+
+def _lex_files(directory, jobs):
+    # Runs in a worker process. The message handler must not print: the
+    # worker shares its stdout with the language server.
+    token_cache = Token_Cache(directory)
+    results = []
+    for file_name, file_content in jobs:
+        from_disk = file_content is None
+        try:
+            if from_disk:
+                with open(file_name, "r", encoding="UTF-8") as fd:
+                    file_content = fd.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        stamp = token_cache.stamp(file_name, file_content, from_disk)
+        tokens = token_cache.get(file_name, stamp)
+        if tokens is None:
+            lexer = Token_Stream(Vscode_Message_Handler(), file_name,
+                                 file_content)
+            try:
+                while lexer.token() is not None:
+                    pass
+            except TRLC_Error:
+                # Reported when the file is lexed again by the parser
+                continue
+            tokens = encode_tokens(lexer.tokens)
+            token_cache.put(file_name, stamp, tokens)
+        results.append((file_name, stamp, tokens))
+    return results
+
+
+class Lexer_Pool:
+    """Lexes files in a pool of worker processes.
+
+    Lexing a file does not depend on any other file, so all files of a
+    parse can be lexed in parallel before TRLC parses them one by one.
+    Workers check the Token_Cache first and store what they lex in it;
+    the token streams are handed back in the encoding of the Token_Cache
+    and replayed by a Cached_Token_Stream.
+    """
+
+    def __init__(self, token_cache):
+        self.token_cache = token_cache
+        self.workers = 0
+        self.pool = None
+
+    def set_workers(self, workers):
+        """Set the number of worker processes; 0 means one per CPU, 1 lexes
+        on the calling thread instead."""
+        if workers != self.workers:
+            self.workers = workers
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            # Never fork: the server process is multi-threaded
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers or None,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def lex(self, jobs, check_cancelled):
+        """Lex the given (file name, content or None) pairs.
+
+        Returns a dict mapping file names to (stamp, tokens). Files that
+        cannot be read or lexed are left out, as are all files if there
+        are too few of them to be worth it. check_cancelled is called while
+        waiting, and may raise to abandon the work.
+        """
+        workers = self.workers or os.cpu_count() or 1
+        if workers < 2 or len(jobs) < MIN_FILES:
+            return {}
+
+        # A few chunks per worker, to balance files of different size
+        chunk_size = max(1, len(jobs) // (workers * 4))
+        futures = {
+            self.get_pool().submit(_lex_files, self.token_cache.directory,
+                                   jobs[n:n + chunk_size])
+            for n in range(0, len(jobs), chunk_size)
+        }
+        results = {}
+        try:
+            while futures:
+                check_cancelled()
+                done, futures = wait(futures, timeout=POLL_SECONDS,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        chunk = future.result()
+                    except Exception:  # pylint: disable=W0718
+                        # The parser thread lexes these files itself
+                        LOGGER.error("TRLC: Lexer worker failed",
+                                     exc_info=True)
+                        continue
+                    for file_name, stamp, tokens in chunk:
+                        results[file_name] = (stamp, tokens)
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
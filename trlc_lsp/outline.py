@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Document symbols and folding ranges of a file, derived from its tokens
+once per parse."""
+
+import trlc.ast
+from lsprotocol.types import (DocumentSymbol, FoldingRange, FoldingRangeKind,
+                              Position, Range, SymbolKind)
+
+SYMBOL_KINDS = {
+    trlc.ast.Package: SymbolKind.Package,
+    trlc.ast.Section: SymbolKind.Namespace,
+    trlc.ast.Record_Type: SymbolKind.Class,
+    trlc.ast.Tuple_Type: SymbolKind.Struct,
+    trlc.ast.Enumeration_Type: SymbolKind.Enum,
+    trlc.ast.Enumeration_Literal_Spec: SymbolKind.EnumMember,
+    trlc.ast.Composite_Component: SymbolKind.Field,
+    trlc.ast.Record_Object: SymbolKind.Object,
+}
+
+BRACKETS = {"C_KET": "C_BRA", "S_KET": "S_BRA", "KET": "BRA"}
+
+
+def _position(key):
+    return Position(line=key >> 32, character=key & 0xFFFFFFFF)
+
+
+def _declared_entity(tok):
+    """Return the entity declared by the token, or None if the token does
+    not declare one."""
+    entity = tok.ast_link
+    if (tok.kind not in ("IDENTIFIER", "STRING") or
+            type(entity) not in SYMBOL_KINDS):
+        return None
+    location = entity.location
+    if (location.start_pos != tok.location.start_pos or
+            location.file_name != tok.location.file_name):
+        return None
+    return entity
+
+
+class Outline_Node:
+    """A document symbol under construction, by token index."""
+
+    def __init__(self, entity, selection, start):
+        self.entity = entity
+        self.selection = selection
+        self.start = start
+        self.end = selection
+        self.children = []
+
+
+class Outline:
+    """The document symbols and folding ranges of one file.
+
+    Both come from a single pass over the tokens of the file. Every token
+    that declares an entity, i.e. whose AST link is an entity declared at
+    that token, becomes a symbol. It spans from the first token of its line
+    that no other symbol claimed up to its closing brace or, without braces,
+    the last token on the line where it ends. Symbols declared within the
+    braces of a symbol are its children. Brackets spanning lines, comments
+    spanning lines, runs of line comments and runs of imports can be
+    folded.
+    """
+
+    def __init__(self, token_index):
+        self.token_index = token_index
+        self.symbols = []
+        self.folding_ranges = []
+        self.build()
+
+    def line(self, n):
+        return self.token_index.starts[n] >> 32
+
+    def end_line(self, n):
+        return self.token_index.ends[n] >> 32
+
+    def build(self):
+        index = self.token_index
+        top = []
+        frames = [(None, top)]
+        brackets = []
+        current = None
+        claimed = -1
+        comments = None
+        imports = None
+        for n, tok in enumerate(index.tokens):
+            kind = tok.kind
+            if kind in ("C_BRA", "S_BRA", "BRA"):
+                brackets.append((kind, self.line(n)))
+            elif kind in BRACKETS:
+                self.fold_brackets(brackets, BRACKETS[kind], self.line(n))
+
+            if kind == "COMMENT":
+                comments = self.fold_run(comments, n, FoldingRangeKind.Comment)
+                continue
+            if comments is not None:
+                comments = self.fold_run(comments, None, None)
+            if kind == "KEYWORD" and tok.value == "import":
+                imports = self.fold_run(imports, n, FoldingRangeKind.Imports)
+
+            entity = _declared_entity(tok)
+            if kind == "C_BRA":
+                # The brace belongs to the symbol declared just before it
+                owner = (current if current is not None and
+                         tok.ast_link is current.entity else None)
+                frames.append((owner, owner.children if owner is not None
+                               else frames[-1][1]))
+                current = None
+                claimed = n
+            elif kind == "C_KET":
+                if len(frames) > 1:
+                    owner = frames.pop()[0]
+                    if owner is not None:
+                        owner.end = n
+                current = None
+                claimed = n
+            elif entity is not None:
+                line_start = index.span(self.line(n), 0,
+                                        self.line(n) + 1, 0).start
+                current = Outline_Node(entity, n, max(claimed + 1,
+                                                      line_start))
+                frames[-1][1].append(current)
+                claimed = n
+            elif (current is not None and
+                  self.line(n) == self.line(current.end)):
+                current.end = n
+                claimed = n
+
+        for run in (comments, imports):
+            self.fold_run(run, None, None)
+        self.symbols = [self.to_symbol(node) for node in top]
+
+    def fold_brackets(self, brackets, opening, line):
+        # Brackets left open by syntax errors are skipped
+        while brackets:
+            kind, start_line = brackets.pop()
+            if kind == opening:
+                # The line of the closing bracket stays visible
+                if line - 1 > start_line:
+                    self.folding_ranges.append(FoldingRange(
+                        start_line=start_line, end_line=line - 1))
+                return
+
+    def fold_run(self, run, n, kind):
+        """Extend a run (start line, end line, kind) of comments or imports
+        with the token n, or close it and start a new one. A comment
+        spanning lines folds on its own."""
+        if n is not None:
+            start_line = self.line(n)
+            end_line = self.end_line(n)
+            if (run is not None and start_line == run[1] + 1 and
+                    end_line == start_line):
+                return (run[0], end_line, kind)
+        if run is not None and run[1] > run[0]:
+            self.folding_ranges.append(FoldingRange(
+                start_line=run[0], end_line=run[1], kind=run[2]))
+        return None if n is None else (start_line, end_line, kind)
+
+    def to_symbol(self, node):
+        starts = self.token_index.starts
+        ends = self.token_index.ends
+        entity = node.entity
+        detail = None
+        if isinstance(entity, (trlc.ast.Record_Object,
+                               trlc.ast.Composite_Component)):
+            detail = entity.n_typ.name
+        elif (isinstance(entity, trlc.ast.Record_Type) and
+              entity.parent is not None):
+            detail = "extends %s" % entity.parent.name
+        return DocumentSymbol(
+            name=entity.name,
+            kind=SYMBOL_KINDS[type(entity)],
+            detail=detail,
+            range=Range(start=_position(starts[node.start]),
+                        end=_position(ends[node.end])),
+            selection_range=Range(
+                start=_position(starts[node.selection]),
+                end=_position(ends[node.selection])),
+            children=[self.to_symbol(child)
+                      for child in node.children] or None)
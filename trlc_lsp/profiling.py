@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Profiling of the next parse or requests, started by a command."""
+
+import asyncio
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger()
+
+# Number of functions listed in the summary, per sort order
+TOP_FUNCTIONS = 30
+
+
+class Profiler:
+    """Runs the next parse, or the next requests, under cProfile.
+
+    Once the requested number of them is done, the profile is written to a
+    .prof file (for pstats, snakeviz and the like) and a summary of the top
+    functions to a .txt file next to it, in the directory of pygls.log.
+    on_written is then called with the two paths.
+    """
+
+    def __init__(self, on_written=None, directory=None):
+        self.on_written = on_written
+        self.directory = directory or tempfile.gettempdir()
+        self.lock = threading.Lock()
+        self.kind = None
+        self.remaining = 0
+        self.done = 0
+        self.seconds = 0.0
+        self.profile = None
+        self.running = False
+
+    def request(self, kind, count=1):
+        """Profile the next count parses (kind "parse") or requests (kind
+        "requests"). Replaces a profile that was requested but has not
+        started yet; returns False if one is running."""
+        with self.lock:
+            if self.running or self.done:
+                return False
+            self.kind = kind
+            self.remaining = max(1, count)
+            self.seconds = 0.0
+            self.profile = cProfile.Profile()
+            return True
+
+    @contextmanager
+    def profiling(self, kind):
+        """Profile the enclosed code if a profile of kind was requested."""
+        with self.lock:
+            profile = None
+            if self.kind == kind and self.remaining and not self.running:
+                profile = self.profile
+                self.running = True
+        if profile is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler, e.g. of a debugger, is active
+            LOGGER.warning("TRLC: Unable to start profiling", exc_info=True)
+            with self.lock:
+                self.running = False
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.finish(profile, time.perf_counter() - start)
+
+    def profiled_handler(self, handler):
+        """Return handler wrapped to be profiled as one of the requests.
+        While an asynchronous handler awaits, whatever else runs on the
+        event loop is part of its profile."""
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def profiled_async(*args, **kwargs):
+                with self.profiling("requests"):
+                    return await handler(*args, **kwargs)
+            return profiled_async
+
+        @functools.wraps(handler)
+        def profiled(*args, **kwargs):
+            with self.profiling("requests"):
+                return handler(*args, **kwargs)
+        return profiled
+
+    def finish(self, profile, seconds):
+        with self.lock:
+            self.running = False
+            self.remaining -= 1
+            self.done += 1
+            self.seconds += seconds
+            if self.remaining:
+                return
+            kind, done, seconds = self.kind, self.done, self.seconds
+            self.kind = None
+            self.profile = None
+        try:
+            paths = self.write(profile, kind, done, seconds)
+        finally:
+            with self.lock:
+                self.done = 0
+        if paths and self.on_written:
+            self.on_written(*paths)
+
+    def write(self, profile, kind, count, seconds):
+        """Write the profile and its summary. Returns their paths, or None
+        if they could not be written."""
+        base = os.path.join(self.directory,
+                            "trlc-profile-%s-%s" %
+                            (kind, time.strftime("%Y%m%d-%H%M%S")))
+        summary = io.StringIO()
+        summary.write("TRLC profile of %u %s, %.3f s in total\n\n" %
+                      (count, "parse(s)" if kind == "parse" else "request(s)",
+                       seconds))
+        stats = pstats.Stats(profile, stream=summary).strip_dirs()
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_FUNCTIONS)
+        try:
+            profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="UTF-8") as fd:
+                fd.write(summary.getvalue())
+        except OSError:
+            LOGGER.error("TRLC: Unable to write the profile", exc_info=True)
+            return None
+        return base + ".prof", base + ".txt"
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Recording of the JSON-RPC messages of a session, for replaying them
+with benchmarks/replay_session.py."""
+
+import json
+import threading
+import time
+
+CLIENT = "client"
+SERVER = "server"
+
+
+class Recording_Writer:
+    """Wraps the writer of the protocol to record what is sent."""
+
+    def __init__(self, writer, recorder):
+        self.writer = writer
+        self.recorder = recorder
+
+    def write(self, data):
+        # Every write is one message, with or without headers
+        body = data.split(b"\r\n\r\n", 1)[-1]
+        try:
+            self.recorder.record(SERVER, json.loads(body))
+        except ValueError:
+            pass
+        return self.writer.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.writer, name)
+
+
+class Session_Recorder:
+    """Writes every message received or sent by a protocol to a file, one
+    JSON object per line: the seconds since the recording started, who
+    sent the message (client or server), and the message itself."""
+
+    def __init__(self, file_name):
+        self.fd = open(file_name, "w",  # pylint: disable=R1732
+                       encoding="UTF-8", buffering=1)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def attach(self, protocol):
+        """Record the messages of the given pygls protocol."""
+        structure_message = protocol.structure_message
+        set_writer = protocol.set_writer
+
+        def recording_structure_message(data):
+            # Called for every JSON object of a message; only the message
+            # itself has a jsonrpc member.
+            if "jsonrpc" in data:
+                self.record(CLIENT, data)
+            return structure_message(data)
+
+        def recording_set_writer(writer, *args, **kwargs):
+            return set_writer(Recording_Writer(writer, self), *args, **kwargs)
+
+        protocol.structure_message = recording_structure_message
+        protocol.set_writer = recording_set_writer
+
+    def record(self, sender, message):
+        with self.lock:
+            self.fd.write(json.dumps({
+                "time": round(time.perf_counter() - self.start, 6),
+                "from": sender,
+                "message": message}) + "\n")
+
+
+def read_session(file_name):
+    """Return the records of a session written by Session_Recorder, as
+    (time, sender, message) tuples."""
+    records = []
+    with open(file_name, "r", encoding="UTF-8") as fd:
+        for line in fd:
+            if line.strip():
+                record = json.loads(line)
+                records.append((record["time"], record["from"],
+                                record["message"]))
+    return records
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Scheduling of parses: how long to wait for further edits."""
+
+import threading
+import time
+
+# Weight of the latest measurement in the moving averages
+SMOOTHING = 0.3
+
+# Assumed until the first parse has been measured
+DEFAULT_PARSE_SECONDS = 0.3
+
+
+def _average(average, value):
+    if average is None:
+        return value
+    return average + SMOOTHING * (value - average)
+
+
+class Adaptive_Debounce:
+    """Works out how long the validator waits after an event before it
+    starts parsing.
+
+    Events other than keystrokes (opening, saving or closing a document,
+    configuration and file system changes, "Parse All") are parsed after
+    the minimum delay. After a keystroke the delay depends on moving
+    averages of the parse duration and of the gaps between keystrokes. If
+    a parse is expected to finish before the next keystroke, the minimum
+    delay is used, so that diagnostics keep up with the typing. Otherwise
+    the validator waits for a pause in typing about as long as a parse, so
+    that parses are not started only to be cancelled by the next
+    keystroke. The delay always stays within the configured bounds.
+    """
+
+    def __init__(self, minimum=0.05, maximum=2.0):
+        self.lock = threading.Lock()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.parse_seconds = None
+        self.gap_seconds = None
+        self.last_keystroke = None
+        self.urgent = False
+
+    def set_bounds(self, minimum=None, maximum=None):
+        with self.lock:
+            if minimum is not None:
+                self.minimum = minimum
+            if maximum is not None:
+                self.maximum = maximum
+            self.maximum = max(self.minimum, self.maximum)
+
+    def keystroke(self):
+        """Record an edit of a document."""
+        now = time.perf_counter()
+        with self.lock:
+            if self.last_keystroke is not None:
+                gap = now - self.last_keystroke
+                # Longer gaps are pauses, not typing
+                if gap < self.maximum:
+                    self.gap_seconds = _average(self.gap_seconds, gap)
+            self.last_keystroke = now
+
+    def expedite(self):
+        """Record an event that is parsed after the minimum delay."""
+        with self.lock:
+            self.urgent = True
+
+    def consumed(self):
+        """Called when the validator takes the queued events."""
+        with self.lock:
+            self.urgent = False
+
+    def parsed(self, seconds):
+        """Record the duration of a parse, up to its diagnostics."""
+        with self.lock:
+            self.parse_seconds = _average(self.parse_seconds, seconds)
+
+    def delay(self):
+        """Return the seconds to wait for further events before parsing."""
+        with self.lock:
+            if self.urgent:
+                return self.minimum
+            parse_seconds = (DEFAULT_PARSE_SECONDS
+                             if self.parse_seconds is None
+                             else self.parse_seconds)
+            if (self.gap_seconds is not None and
+                    parse_seconds <= self.gap_seconds):
+                return self.minimum
+            return min(max(parse_seconds, self.minimum), self.maximum)
+
+    def snapshot(self):
+        """Return the state as a JSON compatible dict, for trlc/stats."""
+        delay = self.delay()
+        with self.lock:
+            return {
+                "delay_ms": round(delay * 1000, 3),
+                "parse_ms": (None if self.parse_seconds is None
+                             else round(self.parse_seconds * 1000, 3)),
+                "keystroke_gap_ms": (None if self.gap_seconds is None
+                                     else round(self.gap_seconds * 1000, 3)),
+                "min_ms": round(self.minimum * 1000, 3),
+                "max_ms": round(self.maximum * 1000, 3),
+            }
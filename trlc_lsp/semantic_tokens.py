@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Semantic tokens, classified and encoded by the validator thread once
+per parse."""
+
+from array import array
+
+import trlc.ast
+from lsprotocol.types import SemanticTokensEdit
+
+from .trlc_utils import get_ast_entity
+
+# ---------------------------------------------------------------------------
+# LSP Semantic Token Types
+# The order here defines the index used in the encoded token data.
+# ---------------------------------------------------------------------------
+SEMANTIC_TOKEN_TYPES = [
+    "keyword",    # 0
+    "comment",    # 1
+    "string",     # 2
+    "number",     # 3
+    "operator",  # 4
+    "namespace",  # 5
+    "type",       # 6
+    "variable",   # 7
+    "enumMember",  # 8
+    "property",   # 9
+]
+
+_SEMANTIC_KEYWORD = 0
+_SEMANTIC_COMMENT = 1
+_SEMANTIC_STRING = 2
+_SEMANTIC_NUMBER = 3
+_SEMANTIC_OPERATOR = 4
+_SEMANTIC_NAMESPACE = 5
+_SEMANTIC_TYPE = 6
+_SEMANTIC_VARIABLE = 7
+_SEMANTIC_ENUM_MEMBER = 8
+_SEMANTIC_PROPERTY = 9
+
+# Static mapping from TRLC lexer token kind to semantic type index.
+# IDENTIFIER is handled dynamically via the AST link.
+_KIND_TO_SEMANTIC = {
+    "KEYWORD": _SEMANTIC_KEYWORD,
+    "COMMENT": _SEMANTIC_COMMENT,
+    "STRING": _SEMANTIC_STRING,
+    "INTEGER": _SEMANTIC_NUMBER,
+    "DECIMAL": _SEMANTIC_NUMBER,
+    "OPERATOR": _SEMANTIC_OPERATOR,
+}
+
+
+def get_token_semantic_type(tok):
+    """Return the LSP semantic token type index for tok, or None to skip."""
+    st = _KIND_TO_SEMANTIC.get(tok.kind)
+    if st is not None:
+        return st
+
+    if tok.kind == "IDENTIFIER" and tok.ast_link is not None:
+        ast_obj = get_ast_entity(tok)
+        if ast_obj is None:
+            return _SEMANTIC_VARIABLE
+        if isinstance(ast_obj, trlc.ast.Package):
+            return _SEMANTIC_NAMESPACE
+        if isinstance(ast_obj, (trlc.ast.Record_Type,
+                                trlc.ast.Tuple_Type,
+                                trlc.ast.Enumeration_Type,
+                                trlc.ast.Builtin_Type)):
+            return _SEMANTIC_TYPE
+        if isinstance(ast_obj, trlc.ast.Enumeration_Literal_Spec):
+            return _SEMANTIC_ENUM_MEMBER
+        if isinstance(ast_obj, trlc.ast.Composite_Component):
+            return _SEMANTIC_PROPERTY
+        return _SEMANTIC_VARIABLE
+
+    return None
+
+
+class Semantic_Tokens:
+    """Semantic token types of the tokens of one file, and their encoding
+    for a request of the whole file.
+
+    The types are stored per token in a compact array, aligned with the
+    Token_Index of the file, so that ranges can be encoded without
+    classifying the tokens again. Tokens that are not highlighted, and
+    tokens that span multiple lines (block comments, triple-quoted strings)
+    have type -1: the LSP semantic token encoding does not support
+    multi-line tokens, the TextMate grammar in the VS Code extension
+    handles those as a fallback.
+    """
+
+    def __init__(self, token_index):
+        self.token_index = token_index
+        self.types = array("b")
+        for n, tok in enumerate(token_index.tokens):
+            sem_type = None
+            if not token_index.is_multi_line(n):
+                sem_type = get_token_semantic_type(tok)
+            self.types.append(-1 if sem_type is None else sem_type)
+        self.data = self.encode(range(len(self.types)))
+
+    def encode(self, indexes):
+        """Encode the tokens with the given indexes in LSP semantic token
+        delta format."""
+        # https://microsoft.github.io/language-server-protocol/specifications/lsp/3.17/specification/#textDocument_semanticTokens
+        starts   = self.token_index.starts
+        ends     = self.token_index.ends
+        cur_line = 0
+        cur_col  = 0
+        data     = array("I")
+        for n in indexes:
+            sem_type = self.types[n]
+            if sem_type < 0:
+                continue
+            line = starts[n] >> 32
+            col  = starts[n] & 0xFFFFFFFF
+            if line > cur_line:
+                delta_start = col
+            else:
+                delta_start = col - cur_col
+            data.extend((line - cur_line, delta_start, ends[n] - starts[n],
+                         sem_type, 0))
+            cur_line = line
+            cur_col  = col
+        return data
+
+
+def diff_semantic_tokens(old, new):
+    """Return the edit turning the encoded semantic tokens old into new.
+    The edit is aligned to whole tokens (five integers each)."""
+    size = min(len(old), len(new))
+    start = 0
+    while start < size and old[start] == new[start]:
+        start += 1
+    start -= start % 5
+    end = 0
+    while end < size - start and old[-end - 1] == new[-end - 1]:
+        end += 1
+    end -= end % 5
+    return SemanticTokensEdit(start=start,
+                              delete_count=len(old) - start - end,
+                              data=new[start:len(new) - end])
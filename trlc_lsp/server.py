@@ -21,161 +21,204 @@
 # This server is derived from the pygls example server, licensed under
 # the Apache License, Version 2.0.
 
+import asyncio
+import functools
 import logging
 import os
+import re
 import sys
 import threading
 import time
 import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import trlc.ast
 import trlc.errors
 import trlc.lexer
-from lsprotocol.types import (TEXT_DOCUMENT_COMPLETION,
+from lsprotocol.types import (COMPLETION_ITEM_RESOLVE, INITIALIZED,
+                              TEXT_DOCUMENT_COMPLETION,
+                              TEXT_DOCUMENT_DOCUMENT_SYMBOL,
+                              TEXT_DOCUMENT_FOLDING_RANGE,
                               TEXT_DOCUMENT_DID_CHANGE,
                               TEXT_DOCUMENT_DID_CLOSE, TEXT_DOCUMENT_DID_OPEN,
+                              TEXT_DOCUMENT_DID_SAVE,
                               TEXT_DOCUMENT_HOVER, TEXT_DOCUMENT_REFERENCES,
                               TEXT_DOCUMENT_RENAME,
                               TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+                              TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+                              TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
                               TEXT_DOCUMENT_TYPE_DEFINITION,
                               WORKSPACE_DID_CHANGE_CONFIGURATION,
+                              WORKSPACE_DID_CHANGE_WATCHED_FILES,
                               WORKSPACE_DID_CHANGE_WORKSPACE_FOLDERS,
-                              CompletionItem, CompletionList,
+                              WORKSPACE_SYMBOL,
+                              CompletionItem, CompletionItemKind,
+                              CompletionList,
                               CompletionOptions, CompletionParams,
                               ConfigurationItem, ConfigurationParams,
                               DidChangeConfigurationParams,
                               DidChangeTextDocumentParams,
+                              DidChangeWatchedFilesParams,
+                              DidChangeWatchedFilesRegistrationOptions,
                               DidChangeWorkspaceFoldersParams,
                               DidCloseTextDocumentParams,
-                              DidOpenTextDocumentParams, Hover, Location,
-                              LogMessageParams, MessageType,
+                              DidOpenTextDocumentParams,
+                              DidSaveTextDocumentParams,
+                              DocumentSymbolParams, FileChangeType,
+                              FileSystemWatcher, FoldingRangeParams, Hover,
+                              InitializedParams,
+                              Location,
+                              LogMessageParams, MarkupContent, MarkupKind,
+                              MessageType,
                               OptionalVersionedTextDocumentIdentifier,
                               Position, PublishDiagnosticsParams, Range,
-                              ReferenceParams, RenameParams,
-                              SemanticTokens, SemanticTokensLegend,
-                              SemanticTokensParams, ShowMessageParams,
+                              ReferenceParams, Registration,
+                              RegistrationParams, RenameParams,
+                              SemanticTokens, SemanticTokensDelta,
+                              SemanticTokensDeltaParams,
+                              SemanticTokensLegend, SemanticTokensParams,
+                              SemanticTokensRangeParams, ShowMessageParams,
                               TextDocumentEdit,
-                              TextDocumentPositionParams, TextEdit,
-                              TypeDefinitionParams, WorkspaceEdit)
+                              SymbolKind, TextDocumentPositionParams,
+                              TextEdit,
+                              TypeDefinitionParams, WorkspaceEdit,
+                              WorkspaceSymbol, WorkspaceSymbolParams)
 from pygls.lsp.server import LanguageServer
 
-from .trlc_utils import (File_Handler, Vscode_Message_Handler,
-                         Vscode_Source_Manager)
+from .cache import Token_Cache, Verification_Cache, get_cache_dir
+from .indexes import (Completion_Index, Reference_Index, Symbol_Index,
+                      Token_Index)
+from .inventory import Workspace_Inventory
+from .lexing import Lexer_Pool
+from .outline import SYMBOL_KINDS, Outline
+from .profiling import Profiler
+from .scheduling import Adaptive_Debounce
+from .semantic_tokens import (SEMANTIC_TOKEN_TYPES, Semantic_Tokens,
+                              diff_semantic_tokens)
+from .snapshot import Parse_Snapshot
+from .stats import Server_Stats
+from .trlc_utils import (Dependency_Graph, File_Handler, Parse_Cancelled,
+                         Vscode_Message_Handler, get_ast_entity, path_to_uri)
 
 LOGGER = logging.getLogger()
 WAIT_PARSING = "TRLC: Please wait for parsing to finish"
+IDENTIFIER_END = re.compile(r"\w*$")
 
-DEBOUNCE_SECONDS = 0.3
-
-# ---------------------------------------------------------------------------
-# LSP Semantic Token Types
-# The order here defines the index used in the encoded token data.
-# ---------------------------------------------------------------------------
-SEMANTIC_TOKEN_TYPES = [
-    "keyword",    # 0
-    "comment",    # 1
-    "string",     # 2
-    "number",     # 3
-    "operator",  # 4
-    "namespace",  # 5
-    "type",       # 6
-    "variable",   # 7
-    "enumMember",  # 8
-    "property",   # 9
-]
-
-_SEMANTIC_KEYWORD = 0
-_SEMANTIC_COMMENT = 1
-_SEMANTIC_STRING = 2
-_SEMANTIC_NUMBER = 3
-_SEMANTIC_OPERATOR = 4
-_SEMANTIC_NAMESPACE = 5
-_SEMANTIC_TYPE = 6
-_SEMANTIC_VARIABLE = 7
-_SEMANTIC_ENUM_MEMBER = 8
-_SEMANTIC_PROPERTY = 9
-
-# Static mapping from TRLC lexer token kind to semantic type index.
-# IDENTIFIER is handled dynamically via the AST link.
-_KIND_TO_SEMANTIC = {
-    "KEYWORD": _SEMANTIC_KEYWORD,
-    "COMMENT": _SEMANTIC_COMMENT,
-    "STRING": _SEMANTIC_STRING,
-    "INTEGER": _SEMANTIC_NUMBER,
-    "DECIMAL": _SEMANTIC_NUMBER,
-    "OPERATOR": _SEMANTIC_OPERATOR,
-}
-
-
-def _get_token_semantic_type(tok):
-    """Return the LSP semantic token type index for tok, or None to skip.
-
-    Tokens that span multiple lines (block comments, triple-quoted strings)
-    are skipped — None is returned — because the LSP semantic token encoding
-    does not support multi-line tokens.  The TextMate grammar in the VS Code
-    extension handles those as a fallback.
-    """
-    # Skip multi-line tokens; LSP encoding requires single-line spans.
-    token_text = tok.location.lexer.content[
-        tok.location.start_pos:tok.location.end_pos + 1
-    ]
-    if "\n" in token_text:
-        return None
+# Number of requests profiled by extension.profileRequests by default
+PROFILE_REQUESTS = 20
+
+# Threads running the handlers of long requests, such as references
+REQUEST_WORKERS = 4
+
+# Number of completion items returned at most by default; the client asks
+# again for more specific ones as the user types
+COMPLETION_LIMIT = 200
 
-    st = _KIND_TO_SEMANTIC.get(tok.kind)
-    if st is not None:
-        return st
-
-    if tok.kind == "IDENTIFIER" and tok.ast_link is not None:
-        ast_obj = _get_ast_entity(tok)
-        if ast_obj is None:
-            return _SEMANTIC_VARIABLE
-        if isinstance(ast_obj, trlc.ast.Package):
-            return _SEMANTIC_NAMESPACE
-        if isinstance(ast_obj, (trlc.ast.Record_Type,
-                                trlc.ast.Tuple_Type,
-                                trlc.ast.Enumeration_Type,
-                                trlc.ast.Builtin_Type)):
-            return _SEMANTIC_TYPE
-        if isinstance(ast_obj, trlc.ast.Enumeration_Literal_Spec):
-            return _SEMANTIC_ENUM_MEMBER
-        if isinstance(ast_obj, trlc.ast.Composite_Component):
-            return _SEMANTIC_PROPERTY
-        return _SEMANTIC_VARIABLE
-
-    return None
+# Number of workspace symbols returned at most
+WORKSPACE_SYMBOL_LIMIT = 100
+
+SEMANTIC_TOKENS_LEGEND = SemanticTokensLegend(
+    token_types=SEMANTIC_TOKEN_TYPES, token_modifiers=[])
 
 
 class TrlcValidator(threading.Thread):
     def __init__(self, server):
-        super().__init__(name="TRLC Parser Thread")
+        super().__init__(name="TRLC Parser Thread", daemon=True)
         self.server = server
+        # Paths of the files changed since the last completed parse, or
+        # None if everything has to be parsed again.
+        self.changed = set()
+
+    def apply_file_event(self, path, kind):
+        """Update the inventory from a file system event. Returns True if
+        the workspace has to be parsed again."""
+        inventory = self.server.inventory
+        if kind == FileChangeType.Created:
+            if not inventory.file_created(path):
+                return False
+            self.changed = None
+        elif kind == FileChangeType.Deleted:
+            if not inventory.file_deleted(path):
+                return False
+            self.server.semantic_results.pop(path_to_uri(path), None)
+            self.changed = None
+        else:
+            # Only files that were parsed matter, unless they are open in
+            # the editor, whose content takes precedence.
+            if (path not in self.server.graph.file_packages or
+                    path_to_uri(path) in self.server.fh.files):
+                return False
+            if self.changed is not None:
+                self.changed.add(path)
+        return True
 
     def validate(self):
         while True:
+            force = False
             with self.server.queue_lock:
-                if not self.server.queue:
+                if not (self.server.queue or self.server.file_events):
                     return
-                while self.server.queue:
-                    action, uri, content = self.server.queue.pop()
+                self.server.stats.add_queue_depth(
+                    len(self.server.queue) + len(self.server.file_events))
+                self.server.debounce.consumed()
+                for uri, (action, content) in self.server.queue.items():
                     if action == "change":
                         self.server.fh.update_files(uri, content)
-                    elif action == "reparse":
-                        pass
-                    else:
+                        if self.changed is not None:
+                            self.changed.add(_get_path(uri))
+                    elif action == "delete":
                         self.server.fh.delete_files(uri)
-            self.server.validate()
+                        self.changed = None
+                    elif action == "refresh":
+                        self.changed = None
+                        self.server.inventory.invalidate()
+                        force = True
+                    else:
+                        self.changed = None
+                self.server.queue.clear()
+                for path, kind in self.server.file_events.items():
+                    force |= self.apply_file_event(path, kind)
+                self.server.file_events.clear()
+                generation = self.server.generation
+
+            # Nothing to do if the inputs are back to those of the last
+            # parse, e.g. after an undo or a configuration change that does
+            # not affect TRLC. Without file system events, the files on
+            # disk may have changed too.
+            if not force and self.server.watching_files and \
+                    self.server.get_inputs() == self.server.parsed_inputs:
+                self.changed = set()
+                self.server.stats.count("parses_skipped")
+                continue
+
+            # Without file system events, files added or removed since the
+            # last parse are only found by scanning the folders again.
+            if not self.server.watching_files:
+                self.server.inventory.invalidate()
+
+            # A cancelled parse leaves the previous results in place, so its
+            # changes are carried over to the next parse.
+            with self.server.profiler.profiling("parse"):
+                completed = self.server.validate(self.changed, generation)
+            if completed:
+                self.changed = set()
 
     def run(self):
+        self.server.warm_up()
         while True:
             self.server.trigger_parse.wait()
-            self.server.trigger_parse.clear()
-            # Debounce: wait for edits to settle before parsing
+            # Debounce: wait for edits to settle before parsing. Every new
+            # event starts the wait again, with a delay that depends on
+            # the kind of event.
+            start = time.perf_counter()
             while True:
-                time.sleep(DEBOUNCE_SECONDS)
-                if not self.server.trigger_parse.is_set():
-                    break
                 self.server.trigger_parse.clear()
+                if not self.server.trigger_parse.wait(
+                        self.server.debounce.delay()):
+                    break
+            self.server.stats.add_phase("debounce",
+                                        time.perf_counter() - start)
             self.validate()
 
 
@@ -184,22 +227,130 @@ class TrlcLanguageServer(LanguageServer):
 
     def __init__(self, *args):
         super().__init__(*args)
-        self.diagnostic_history = {}
+        self.fingerprints       = {}
+        self.publish_sent       = 0
+        self.publish_skipped    = 0
+        self.verified_uris      = set()
+        self.semantic_results   = {}
+        self.semantic_results_id = 0
         self.fh                 = File_Handler()
         self.parse_partial      = True
         self.verify_mode        = True
         self.exclude_patterns   = []
         self.queue_lock         = threading.Lock()
-        self.queue              = []
-        self.data_lock          = threading.Lock()
-        self.symbols            = trlc.ast.Symbol_Table()
+        self.queue              = {}
+        self.parsed_inputs      = None
+        self.file_events        = {}
+        self.watching_files     = False
+        self.inventory          = Workspace_Inventory()
+        self.stats              = Server_Stats(self.get_stats)
+        self.profiler           = Profiler(self.profile_written)
+        self.debounce           = Adaptive_Debounce()
+        self.generation         = 0
+        self.snapshot           = Parse_Snapshot()
         self.trigger_parse      = threading.Event()
         self.validator          = TrlcValidator(self)
-        self.all_files          = {}
-        self.validator.start()
+        self.request_pool       = None
+        self.completion_limit   = COMPLETION_LIMIT
+        self.graph              = Dependency_Graph()
+        self.verify_cache       = Verification_Cache(
+            os.path.join(get_cache_dir(), "verification.json"))
+        self.verifier           = None
+        self.verify_workers     = 0
+        self.token_cache        = Token_Cache(
+            os.path.join(get_cache_dir(), "tokens"))
+        self.lexer_pool         = Lexer_Pool(self.token_cache)
+
+    def feature(self, feature_name, options=None, worker=False):
+        """Register a feature handler, recording its latency in stats and
+        profiling it when requests are profiled.
+
+        With worker=True, the handler runs on a thread of the request pool,
+        so that the I/O thread goes on serving other messages meanwhile.
+        It is passed a third argument: a function returning True once the
+        client cancelled the request, which it should check every now and
+        then."""
+        register = super().feature(feature_name, options)
+
+        def decorator(handler):
+            profiled = self.profiler.profiled_handler(handler)
+            if worker:
+                profiled = self.in_worker(profiled)
+            register(self.stats.timed_handler(feature_name, profiled))
+            return handler
+        return decorator
+
+    def in_worker(self, handler):
+        """Return handler as a coroutine running it in the request pool.
+        When the client cancels the request, pygls cancels the coroutine,
+        which tells the handler so."""
+        @functools.wraps(handler)
+        async def run_in_worker(ls, params):
+            cancelled = threading.Event()
+            if self.request_pool is None:
+                self.request_pool = ThreadPoolExecutor(
+                    max_workers=REQUEST_WORKERS,
+                    thread_name_prefix="TRLC Request Thread")
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.request_pool, handler, ls, params, cancelled.is_set)
+            except asyncio.CancelledError:
+                cancelled.set()
+                self.stats.count("requests_cancelled")
+                raise
+        return run_in_worker
+
+    def start_validator(self):
+        """Start the parser thread, unless it is running. Called once the
+        server is initialized, so that it does not slow down the
+        initialization."""
+        with self.queue_lock:
+            if self.validator.ident is None:
+                self.validator.start()
+
+    def warm_up(self):
+        """Import the TRLC front end and CVC5, and load the verification
+        cache. Done in the parser thread ahead of the first parse, as it
+        takes a while."""
+        # pylint: disable=C0415, W0611
+        from . import source_manager, verify
+        self.verify_cache.load()
+
+    def get_verifier(self):
+        if self.verifier is None:
+            from .verify import Verifier  # pylint: disable=C0415
+            self.verifier = Verifier(self.verify_cache)
+            self.verifier.set_workers(self.verify_workers)
+        return self.verifier
+
+    def profile_written(self, profile_path, summary_path):
+        self.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message="TRLC: Profile written to %s, "
+                                      "summary in %s" %
+                                      (profile_path, summary_path)))
+
+    def get_stats(self):
+        """Return the statistics of the server, including those of its
+        caches and the diagnostics published."""
+        stats = self.stats.snapshot()
+        stats["counters"].update({
+            "diagnostics_sent": self.publish_sent,
+            "diagnostics_unchanged": self.publish_skipped,
+            "token_cache_hits": self.token_cache.hits,
+            "token_cache_misses": self.token_cache.misses,
+            "verify_cache_hits": self.verify_cache.hits,
+            "verify_cache_misses": self.verify_cache.misses,
+            "inventory_scans": self.inventory.scans,
+        })
+        stats["debounce"] = self.debounce.snapshot()
+        return stats
 
     def apply_config(self, config):
         """Apply a configuration dict from the client."""
+        if not isinstance(config, dict):
+            # The client has no settings for the server
+            return
         parsing = config.get("parsing")
         if parsing == "full":
             self.parse_partial = False
@@ -211,52 +362,293 @@ class TrlcLanguageServer(LanguageServer):
         patterns = config.get("excludePatterns")
         if isinstance(patterns, list):
             self.exclude_patterns = [str(p) for p in patterns]
+        workers = config.get("verifyWorkers")
+        if isinstance(workers, int) and workers >= 0:
+            self.verify_workers = workers
+            if self.verifier is not None:
+                self.verifier.set_workers(workers)
+        workers = config.get("lexWorkers")
+        if isinstance(workers, int) and workers >= 0:
+            self.lexer_pool.set_workers(workers)
+        minimum = config.get("debounceMin")
+        maximum = config.get("debounceMax")
+        self.debounce.set_bounds(
+            minimum if isinstance(minimum, (int, float)) and minimum >= 0
+            else None,
+            maximum if isinstance(maximum, (int, float)) and maximum >= 0
+            else None)
+        limit = config.get("completionLimit")
+        if isinstance(limit, int) and limit >= 0:
+            self.completion_limit = limit
+        interval = config.get("statsInterval")
+        if isinstance(interval, (int, float)) and interval >= 0:
+            self.stats.set_dump_interval(interval)
+
+    def validate(self, changed=None, generation=None):
+        """Parse the workspace. If changed is a set of file paths, only the
+        packages affected by these files are parsed again; everything else
+        is reused from the previous parse.
+
+        The parse is abandoned as soon as an event newer than generation is
+        queued, or the user cancels it. Returns False if the parse was
+        abandoned before its results were stored."""
+        if generation is None:
+            generation = self.generation
+        inputs = self.get_inputs()
+
+        def cancelled():
+            return generation != self.generation
+
+        previous = self.snapshot
+        reuse = None
+        if changed is not None and previous.all_files:
+            reuse = self.graph.reusable_packages(changed)
+
+        start = time.perf_counter()
+        try:
+            vmh, vsm = self.process(previous, reuse, cancelled)
+            if reuse and vsm.reuse_failed():
+                self.stats.count("reuse_failed")
+                vsm.restore_reused()
+                vmh, vsm = self.process(previous, None, cancelled)
+        except Parse_Cancelled:
+            self.stats.count("parses_cancelled")
+            return False
+        if cancelled():
+            # The previous snapshot stays published, with its packages
+            vsm.restore_reused()
+            self.stats.count("parses_cancelled")
+            return False
+        timings = dict(vsm.timings)
+        timings["parse"] = time.perf_counter() - start
+        start = time.perf_counter()
 
-    def validate(self):
-        vmh = Vscode_Message_Handler()
-        vsm = Vscode_Source_Manager(vmh, self.fh, self,
-                                    verify_mode=self.verify_mode,
-                                    exclude_patterns=self.exclude_patterns)
-
-        for folder_uri in self.workspace.folders.keys():
-            folder_path = _get_path(folder_uri)
-            if not os.path.exists(folder_path):
-                continue
-
-            if self.parse_partial is True:
-                vsm.register_include(folder_path)
-            else:
-                vsm.register_workspace(folder_path)
-
-        if self.parse_partial is True:
-            for file_uri, file_content in self.fh.files.items():
-                file_path = _get_path(file_uri)
-                vsm.register_file(file_path, file_content)
-
-        vsm.process()
         new_symbols = vsm.stab
-        new_all_files = {
-            key.replace('\\', '/'): value
+        new_all_files = dict(vsm.reused_files)
+        new_all_files.update(
+            (key.replace('\\', '/'), value)
             for key, value in vsm.all_files.items()
+        )
+        self.graph.update(new_all_files, vsm, vmh)
+        for file_name in vsm.reused_files:
+            uri = path_to_uri(file_name)
+            if uri in self.graph.parse_diagnostics:
+                vmh.diagnostics.setdefault(uri, []).extend(
+                    self.graph.parse_diagnostics[uri])
+
+        new_token_indexes = {
+            file_name: (previous.token_indexes.get(file_name)
+                        if file_name in vsm.reused_files else None) or
+            Token_Index(parser.lexer.tokens)
+            for file_name, parser in new_all_files.items()
+        }
+        new_semantic_tokens = {
+            file_name: (previous.semantic_tokens.get(file_name)
+                        if file_name in vsm.reused_files else None) or
+            Semantic_Tokens(token_index)
+            for file_name, token_index in new_token_indexes.items()
         }
-        with self.data_lock:
-            self.symbols = new_symbols
-            self.all_files = new_all_files
 
-        for uri in self.diagnostic_history:
-            self.text_document_publish_diagnostics(
-                PublishDiagnosticsParams(uri=uri, diagnostics=[]))
-        for uri, diagnostics in vmh.diagnostics.items():
-            self.text_document_publish_diagnostics(
-                PublishDiagnosticsParams(uri=uri, diagnostics=diagnostics))
-        self.diagnostic_history = vmh.diagnostics
+        new_outlines = {
+            file_name: (previous.outlines.get(file_name)
+                        if file_name in vsm.reused_files else None) or
+            Outline(token_index)
+            for file_name, token_index in new_token_indexes.items()
+        }
+
+        # The reference and symbol indexes are updated after an incremental
+        # parse, otherwise they are rebuilt from scratch.
+        parsed_files = set(new_all_files) - set(vsm.reused_files)
+        if vsm.reused_files:
+            reference_index = previous.reference_index
+            symbol_index = previous.symbol_index
+        else:
+            reference_index = Reference_Index()
+            symbol_index = Symbol_Index()
+
+        self.snapshot = Parse_Snapshot(
+            generation=generation,
+            symbols=new_symbols,
+            all_files=new_all_files,
+            token_indexes=new_token_indexes,
+            semantic_tokens=new_semantic_tokens,
+            outlines=new_outlines,
+            reference_index=reference_index.updated(new_all_files,
+                                                    parsed_files),
+            symbol_index=symbol_index.updated(new_symbols),
+            completion_index=Completion_Index(
+                new_symbols,
+                previous.completion_index if vsm.reused_files else None),
+            diagnostics=vmh.diagnostics,
+            # As of the start of the parse, see get_inputs
+            parse_partial=inputs[2])
+        self.parsed_inputs = inputs
+        timings["indexes"] = time.perf_counter() - start
+        parse = {"generation": generation,
+                 "files_parsed": len(parsed_files),
+                 "files_reused": len(vsm.reused_files)}
+
+        # Diagnostics of a superseded parse would be stale on arrival
+        if cancelled():
+            parse["outcome"] = "superseded"
+            self.stats.add_parse(parse, timings)
+            return True
+        start = time.perf_counter()
+
+        verify = self.verify_mode and vsm.verify_ready
+        # Files that had verification findings are only published once the
+        # findings known from the cache are added again, so that they do
+        # not briefly disappear.
+        held = set(self.verified_uris) if verify else set()
+        self.publish_diagnostics(
+            (set(self.fingerprints) |
+             set(self.snapshot.diagnostics)) - held)
         self.window_log_message(
             LogMessageParams(type=MessageType.Log,
-                             message="TRLC: Diagnostics published"))
+                             message="TRLC: Diagnostics published (%u sent, "
+                                     "%u unchanged so far)" %
+                                     (self.publish_sent,
+                                      self.publish_skipped)))
+        timings["publish"] = time.perf_counter() - start
+        self.debounce.parsed(timings["parse"] + timings["indexes"] +
+                             timings["publish"])
+
+        if verify:
+            start = time.perf_counter()
+            self.verify(new_symbols, cancelled, held)
+            timings["verify"] = time.perf_counter() - start
+        else:
+            self.verified_uris = set()
+        parse["outcome"] = "published"
+        self.stats.add_parse(parse, timings)
+        return True
+
+    def publish_diagnostics(self, uris):
+        """Publish the diagnostics of the snapshot for the given URIs,
+        skipping those that are unchanged since they were last published."""
+        history = self.snapshot.diagnostics
+        for uri in uris:
+            diagnostics = history.get(uri, [])
+            fingerprint = _get_fingerprint(diagnostics)
+            if self.fingerprints.get(uri, ()) == fingerprint:
+                self.publish_skipped += 1
+                continue
+            self.text_document_publish_diagnostics(
+                PublishDiagnosticsParams(uri=uri, diagnostics=diagnostics))
+            self.publish_sent += 1
+            if fingerprint:
+                self.fingerprints[uri] = fingerprint
+            else:
+                del self.fingerprints[uri]
+
+    def verify(self, stab, cancelled, held):
+        """Formally verify the checks of all types and publish the findings
+        on top of the diagnostics of the parse. Verification is abandoned
+        as soon as cancelled returns True."""
+        verified_uris = set()
+
+        def publish(diagnostics):
+            if cancelled():
+                return
+            # The snapshot is replaced, as handlers may be reading it
+            history = dict(self.snapshot.diagnostics)
+            for uri, findings in diagnostics.items():
+                history[uri] = history.get(uri, []) + findings
+                verified_uris.add(uri)
+            self.snapshot = self.snapshot.replace(diagnostics=history)
+            self.publish_diagnostics(set(diagnostics) | held)
+            held.clear()
+
+        if self.get_verifier().verify(stab, publish, cancelled):
+            self.verified_uris = verified_uris
+            self.window_log_message(
+                LogMessageParams(type=MessageType.Log,
+                                 message="TRLC: Verification finished"))
+        else:
+            self.verified_uris = verified_uris | held
+        self.verify_cache.save()
+
+    def process(self, previous, reuse, cancelled=None):
+        # pylint: disable=C0415
+        from .source_manager import Vscode_Source_Manager
+        vmh = Vscode_Message_Handler()
+        # Verification runs separately, once the diagnostics are published
+        vsm = Vscode_Source_Manager(vmh, self.fh, self,
+                                    verify_mode=False,
+                                    exclude_patterns=self.exclude_patterns,
+                                    cancelled=cancelled,
+                                    token_cache=self.token_cache,
+                                    inventory=self.inventory,
+                                    lexer_pool=self.lexer_pool)
+        if reuse:
+            vsm.reuse(previous.symbols, previous.all_files, reuse)
+        try:
+            for folder_uri in self.workspace.folders.keys():
+                folder_path = _get_path(folder_uri)
+                if not os.path.exists(folder_path):
+                    continue
 
-    def queue_event(self, kind, uri=None, content=None):
+                if self.parse_partial is True:
+                    vsm.register_include(folder_path)
+                else:
+                    vsm.register_workspace(folder_path)
+
+            if self.parse_partial is True:
+                files = [(_get_path(file_uri), file_content)
+                         for file_uri, file_content in self.fh.files.items()]
+                vsm.prelex(files)
+                for file_path, file_content in files:
+                    vsm.register_file(file_path, file_content)
+
+            vsm.process()
+        except BaseException:
+            # The reused packages still belong to the published snapshot
+            vsm.restore_reused()
+            raise
+        return vmh, vsm
+
+    def get_inputs(self):
+        """Return a summary of everything a parse depends on, other than
+        the files on disk."""
+        return (tuple(sorted(self.fh.hashes.items())),
+                tuple(sorted(self.workspace.folders)),
+                self.parse_partial,
+                self.verify_mode,
+                tuple(self.exclude_patterns))
+
+    def queue_file_events(self, changes):
+        """Queue file system events, given as (path, FileChangeType)
+        pairs, for the validator thread."""
+        self.start_validator()
+        with self.queue_lock:
+            self.debounce.expedite()
+            for path, kind in changes:
+                # A file created and then changed is still new
+                if (kind == FileChangeType.Changed and
+                        self.file_events.get(path) == FileChangeType.Created):
+                    continue
+                self.file_events[path] = kind
+                self.stats.count("file_events")
+            self.generation += 1
+            self.trigger_parse.set()
+
+    def queue_event(self, kind, uri=None, content=None, keystroke=False):
+        """Queue an event for the validator thread. Only the latest event
+        per URI is kept: "change" (with the new content) or "delete". Events
+        without URI are "reparse", or "refresh" to parse even if no input
+        changed. Edits by keystroke are parsed once typing pauses, all
+        other events as soon as possible."""
+        self.start_validator()
         with self.queue_lock:
-            self.queue.insert(0, (kind, uri, content))
+            if keystroke:
+                self.debounce.keystroke()
+            else:
+                self.debounce.expedite()
+            if self.queue.get(uri, (None,))[0] == "refresh":
+                kind = "refresh"
+            self.queue[uri] = (kind, content)
+            self.stats.count("events")
+            self.generation += 1
             self.trigger_parse.set()
 
 
@@ -287,12 +679,21 @@ def _get_path(uri):
     return path
 
 
-def _get_token(tokens, cursor_line, cursor_col, greedy=False, tok_pre=0):
+def _get_fingerprint(diagnostics):
+    """Return a comparable summary of a list of diagnostics."""
+    return tuple((diag.range.start.line, diag.range.start.character,
+                  diag.range.end.line, diag.range.end.character,
+                  diag.severity, diag.code, diag.message)
+                 for diag in diagnostics)
+
+
+def _get_token(token_index, cursor_line, cursor_col, greedy=False,
+               tok_pre=0):
     """
     Get the token located at the specified cursor position.
 
     Parameters:
-    - tokens (list): A list of tokens to search through.
+    - token_index (Token_Index): The position index of the file's tokens.
     - cursor_line (int): The line number of the cursor position.
     - cursor_col (int): The column number of the cursor position.
     - greedy: (bool): Takes the previous token if there is no match for the
@@ -303,47 +704,10 @@ def _get_token(tokens, cursor_line, cursor_col, greedy=False, tok_pre=0):
     - Token or None: The token found at the cursor position,
       or None if no matching token is found.
     """
-    tok = None
-    while True:
-        for token in tokens:
-            tok_loc = _get_location(token)
-            tok_rng = tok_loc.range
-            if (tok_rng.start.character <= cursor_col <
-                    tok_rng.end.character and
-                    tok_rng.start.line <= cursor_line <= tok_rng.end.line):
-                tok_in = tokens.index(token) - tok_pre
-                if 0 <= tok_in < len(tokens):
-                    tok = tokens[tok_in]
-                break
-        if cursor_col > 0 and greedy and tok is None:
-            cursor_col -= 1
-            continue
-        break
-    return tok
-
-
-def _get_ast_entity(token):
-    """
-    Extracts and returns the AST object of type 'trlc.ast.Entity' linked with
-    the token or any references associated with it.
-
-    Parameters:
-    - token (trlc.lexer.Token): The token from which to extract the AST object.
-
-    Returns:
-    - trlc.ast.Entity or None if the token is not linked with the required
-    types.
-    """
-    assert isinstance(token, trlc.lexer.Token)
-    tok_lk = token.ast_link
-
-    # Get the Entity type based on the type of the attribute token.ast_link
-    return (
-        tok_lk if isinstance(tok_lk, trlc.ast.Entity) else
-        tok_lk.entity if isinstance(tok_lk, trlc.ast.Name_Reference) else
-        tok_lk.target if isinstance(tok_lk, trlc.ast.Record_Reference) else
-        tok_lk.value if isinstance(tok_lk, trlc.ast.Enumeration_Literal) else
-        None)
+    n = token_index.find(cursor_line, cursor_col, greedy)
+    if n < 0:
+        return None
+    return token_index.token(n - tok_pre)
 
 
 def _get_location(obj):
@@ -377,10 +741,44 @@ def _get_location(obj):
 trlc_server = TrlcLanguageServer("pygls-trlc", "v0.1")
 
 
+@trlc_server.feature(INITIALIZED)
+async def on_initialized(ls, _: InitializedParams):
+    """Ask the client for events about TRLC files, to keep the workspace
+    inventory up to date without scanning the folders for every parse."""
+    ls.start_validator()
+    workspace = ls.client_capabilities.workspace
+    watched = workspace and workspace.did_change_watched_files
+    if not (watched and watched.dynamic_registration):
+        return
+    try:
+        await ls.client_register_capability_async(RegistrationParams(
+            registrations=[
+                Registration(
+                    id=str(uuid.uuid4()),
+                    method=WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                    register_options=DidChangeWatchedFilesRegistrationOptions(
+                        watchers=[FileSystemWatcher(
+                            glob_pattern="**/*.{rsl,trlc}")]))
+            ]
+        ))
+    except Exception:  # pylint: disable=W0718
+        LOGGER.error("TRLC: Unable to watch workspace files", exc_info=True)
+        return
+    ls.watching_files = True
+
+
+@trlc_server.feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
+def did_change_watched_files(ls, params: DidChangeWatchedFilesParams):
+    """Watched files did change notification."""
+    ls.queue_file_events((_get_path(change.uri), change.type)
+                         for change in params.changes)
+
+
 @trlc_server.feature(WORKSPACE_DID_CHANGE_WORKSPACE_FOLDERS)
 def on_workspace_folders_change(ls, _: DidChangeWorkspaceFoldersParams):
     """Workspace folders did change notification."""
-    ls.queue_event("reparse")
+    # Folders may have changed while they were not watched
+    ls.queue_event("refresh")
 
 
 @trlc_server.feature(WORKSPACE_DID_CHANGE_CONFIGURATION)
@@ -408,20 +806,61 @@ def did_change(ls, params: DidChangeTextDocumentParams):
     uri = params.text_document.uri
     document = ls.workspace.get_text_document(uri)
     content = document.source
-    ls.queue_event("change", uri, content)
+    ls.queue_event("change", uri, content, keystroke=True)
+
+
+@trlc_server.feature(TEXT_DOCUMENT_DID_SAVE)
+def did_save(ls, _: DidSaveTextDocumentParams):
+    """Text document did save notification: parse pending edits without
+    waiting for a pause in typing."""
+    ls.debounce.expedite()
+    ls.trigger_parse.set()
 
 
 @trlc_server.feature(TEXT_DOCUMENT_DID_CLOSE)
 def did_close(ls, params: DidCloseTextDocumentParams):
     """Text document did close notification."""
     uri = params.text_document.uri
+    # A document opened again starts without a previous result
+    ls.semantic_results.pop(uri, None)
     ls.queue_event("delete", uri)
 
 
+@trlc_server.feature("trlc/stats")
+def trlc_stats(ls, *args):  # pylint: disable=W0613
+    """Custom request returning the timing statistics and counters of the
+    server, for diagnosing slowness."""
+    return ls.get_stats()
+
+
 @trlc_server.command("extension.parseAll")
 def cmd_parse_all(ls, *args):  # pylint: disable=W0613
     ls.parse_partial = False
-    ls.queue_event("reparse")
+    ls.queue_event("refresh")
+
+
+@trlc_server.command("extension.profileParse")
+def cmd_profile_parse(ls, *args):  # pylint: disable=W0613
+    """Profile the next parse, which is started right away."""
+    if not ls.profiler.request("parse"):
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message="TRLC: Profiling is in progress"))
+        return
+    ls.queue_event("refresh")
+
+
+@trlc_server.command("extension.profileRequests")
+def cmd_profile_requests(ls, *args):
+    """Profile the next requests and notifications from the client; their
+    number can be given as argument."""
+    count = PROFILE_REQUESTS
+    if args and isinstance(args[0], int) and args[0] > 0:
+        count = args[0]
+    if not ls.profiler.request("requests", count):
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message="TRLC: Profiling is in progress"))
 
 
 @trlc_server.feature(TEXT_DOCUMENT_DID_OPEN)
@@ -447,7 +886,8 @@ async def did_open(ls, params: DidOpenTextDocumentParams):
 
 
 @trlc_server.feature(TEXT_DOCUMENT_COMPLETION,
-                     CompletionOptions(trigger_characters=["{", " ", "."]))
+                     CompletionOptions(trigger_characters=["{", " ", "."],
+                                       resolve_provider=True))
 def completion(ls, params: CompletionParams):
     """
     Gets completion items at a given cursor position for Package, Components of
@@ -461,7 +901,9 @@ def completion(ls, params: CompletionParams):
       and the trigger character
 
     Returns:
-    - CompletionList: A list of resolved completion items.
+    - CompletionList: At most completion_limit items starting with the name
+      typed so far, marked incomplete if there are more. Their details are
+      added by completion_resolve.
     """
     cursor_line  = params.position.line
     cursor_col   = params.position.character
@@ -470,27 +912,41 @@ def completion(ls, params: CompletionParams):
     file_path    = _get_path(uri)
     items        = []
 
-    with ls.data_lock:
-        try:
-            cur_pkg  = ls.all_files[file_path].cu.package
-            tokens   = ls.all_files[file_path].lexer.tokens
-            symbols  = ls.symbols
-        except KeyError:
-            ls.window_show_message(
-                ShowMessageParams(type=MessageType.Info,
-                                  message=WAIT_PARSING))
-            return CompletionList(is_incomplete=False, items=items)
-
-    tok          = _get_token(tokens, cursor_line, cursor_col - 1, greedy=True)
-    pre_tok      = _get_token(tokens, cursor_line, cursor_col - 1, greedy=True,
-                              tok_pre=1)
+    snapshot = ls.snapshot
+    try:
+        cur_pkg  = snapshot.all_files[file_path].cu.package
+        tokens   = snapshot.token_indexes[file_path]
+        index    = snapshot.completion_index
+    except KeyError:
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message=WAIT_PARSING))
+        return CompletionList(is_incomplete=False, items=items)
+
+    # When completion is invoked on a partially typed name, complete it as
+    # if the character before it had just been typed
+    prefix = ""
+    if trigger_char is None:
+        document = ls.workspace.get_text_document(uri)
+        line = (document.lines[cursor_line]
+                if cursor_line < len(document.lines) else "")
+        prefix = IDENTIFIER_END.search(line[:cursor_col]).group()
+        cursor_col -= len(prefix)
+        if cursor_col > 0:
+            trigger_char = line[cursor_col - 1]
+
+    tok_in       = tokens.find(cursor_line, cursor_col - 1, greedy=True)
+    tok          = tokens.token(tok_in) if tok_in >= 0 else None
+    pre_tok      = tokens.token(tok_in - 1) if tok_in >= 0 else None
     label_list   = None
+    scope        = []
+    kind         = None
 
     # Populate label_list with package names if the trigger character is a
     # space and the token value is either 'package' or 'import'.
     if trigger_char == " " and tok and tok.value in ["package", "import"]:
-        label_list = [f"{value.name}" for value in symbols.table.values()
-                      if isinstance(value, trlc.ast.Package)]
+        label_list = index.package_names.matching(prefix)
+        kind       = CompletionItemKind.Module
 
     # Exit condition: If there is no token at the cursor position
     # or the token lacks an ast_link.
@@ -502,10 +958,8 @@ def completion(ls, params: CompletionParams):
     # Autocomplete non-optional components in Record_Object
     if trigger_char == "{" and isinstance(tok.ast_link,
                                           trlc.ast.Record_Object):
-        label_list = ["".join([f"\n    {c_name} =" if value.optional is False
-                               else "" for c_name, value in
-                               tok.ast_link.n_typ.components.table.items()]) +
-                      "\n"]
+        label_list = [index.skeleton(tok.ast_link.n_typ)]
+        scope      = None
 
     # Autocomplete qualified names of Enumeration_Type
     elif (trigger_char == "." and
@@ -513,14 +967,15 @@ def completion(ls, params: CompletionParams):
           isinstance(pre_tok.ast_link, trlc.ast.Composite_Component) and
           isinstance(pre_tok.ast_link.n_typ, trlc.ast.Enumeration_Type)):
         enu = pre_tok.ast_link.n_typ
-        label_list = [f"{enu.name}.{value.name}" for value in
-                      enu.literals.table.values()]
+        label_list = index.qualified_literals(enu, False).matching(prefix)
+        scope      = [enu.n_package.name, enu.name]
+        kind       = CompletionItemKind.EnumMember
 
     # Autocomplete qualified names of Record_Types
     elif trigger_char == "." and isinstance(tok.ast_link, trlc.ast.Package):
-        label_list = [f"{value.name}" for value in
-                      tok.ast_link.symbols.table.values() if not
-                      isinstance(value, trlc.ast.Record_Object)]
+        label_list = index.types(tok.ast_link).matching(prefix)
+        scope      = [tok.ast_link.name]
+        kind       = CompletionItemKind.Class
 
     # Autocomplete Enumeration_Type
     elif (trigger_char == " " and
@@ -528,40 +983,159 @@ def completion(ls, params: CompletionParams):
           isinstance(tok.ast_link, trlc.ast.Composite_Component) and
           isinstance(tok.ast_link.n_typ, trlc.ast.Enumeration_Type)):
         enu = tok.ast_link.n_typ
-        en_pkg = enu.n_package.name
-        label_list = [
-            f"{en_pkg}.{enu.name}.{value.name}" if en_pkg != cur_pkg.name else
-            f"{enu.name}.{value.name}" for value in enu.literals.table.values()
-        ]
+        label_list = index.qualified_literals(
+            enu, enu.n_package.name != cur_pkg.name).matching(prefix)
+        scope      = [enu.n_package.name, enu.name]
+        kind       = CompletionItemKind.EnumMember
 
     # Autocomplete Enumeration_Literal
     elif (trigger_char == "." and
           isinstance(tok.ast_link, trlc.ast.Enumeration_Type)):
-        label_list = [f"{value.name}" for value in
-                      tok.ast_link.literals.table.values()]
+        enu = tok.ast_link
+        label_list = index.literals(enu).matching(prefix)
+        scope      = [enu.n_package.name, enu.name]
+        kind       = CompletionItemKind.EnumMember
 
     # Autocomplete Tuple_Type components in checks
     elif (trigger_char == "." and
           isinstance(tok.ast_link, trlc.ast.Name_Reference) and
           isinstance(tok.ast_link.typ, trlc.ast.Tuple_Type)):
-        label_list = [f"{value.name}" for value in
-                      tok.ast_link.typ.components.table.values()]
+        tup = tok.ast_link.typ
+        label_list = index.components(tup).matching(prefix)
+        scope      = [tup.n_package.name, tup.name]
+        kind       = CompletionItemKind.Field
 
     # Autocomplete Record_Reference
     elif (trigger_char == " " and
           tok.kind in "ASSIGN" and
           isinstance(tok.ast_link, trlc.ast.Composite_Component) and
           isinstance(tok.ast_link.n_typ, trlc.ast.Record_Type)):
-        pkg_name = tok.ast_link.n_typ.n_package.name
-        label_list = [f"{value.name}" for value in
-                      symbols.table[pkg_name].symbols.table.values() if
-                      isinstance(value, trlc.ast.Record_Object)]
-
+        typ = tok.ast_link.n_typ
+        label_list = index.objects(typ).matching(prefix)
+        scope      = [typ.n_package.name]
+        kind       = CompletionItemKind.Reference
+
+    # Only the first items are sent; as the user types, the client asks
+    # again with a longer prefix. The data of an item is the path of names
+    # that completion_resolve looks up.
+    incomplete = False
     if label_list:
-        items = [CompletionItem(label=label_string) for
-                 label_string in label_list]
+        limit = ls.completion_limit or len(label_list)
+        incomplete = len(label_list) > limit
+        items = [CompletionItem(
+            label=label_string,
+            kind=kind,
+            data=None if scope is None else
+            scope + [label_string.rsplit(".", 1)[-1]])
+            for label_string in label_list[:limit]]
+
+    return CompletionList(is_incomplete=incomplete, items=items)
+
+
+@trlc_server.feature(COMPLETION_ITEM_RESOLVE)
+def completion_resolve(ls, item: CompletionItem):
+    """
+    Adds the details of a completion item, which completion leaves out: the
+    type or kind of its entity, and the description and location of the
+    entity.
+
+    Parameters:
+    - ls: The language server instance.
+    - item: A CompletionItem returned by completion.
+
+    Returns:
+    - CompletionItem: The item with detail and documentation, unless its
+      entity is no longer known.
+    """
+    index = ls.snapshot.completion_index
+    entity = index.lookup(item.data) if isinstance(item.data, list) else None
+    if entity is None:
+        return item
+
+    if isinstance(entity, trlc.ast.Record_Object):
+        typ = entity.n_typ
+        item.detail = f"{typ.n_package.name}.{typ.name}"
+        description = typ.description
+    elif isinstance(entity, trlc.ast.Enumeration_Literal_Spec):
+        enu = entity.n_typ
+        item.detail = f"{enu.n_package.name}.{enu.name}"
+        description = entity.description
+    elif isinstance(entity, trlc.ast.Composite_Component):
+        item.detail = entity.n_typ.name
+        description = entity.description
+    else:
+        item.detail = type(entity).__name__.replace("_", " ").lower()
+        description = getattr(entity, "description", None)
+
+    location = entity.location
+    link = "[%s:%u](%s#L%u)" % (os.path.basename(location.file_name),
+                                location.line_no,
+                                path_to_uri(location.file_name),
+                                location.line_no)
+    item.documentation = MarkupContent(
+        kind=MarkupKind.Markdown,
+        value="\n\n".join(text for text in (description, link) if text))
+    return item
+
+
+@trlc_server.feature(WORKSPACE_SYMBOL)
+def workspace_symbol(ls, params: WorkspaceSymbolParams):
+    """
+    Searches the packages, types, enumeration literals and record objects of
+    all parsed files by name.
 
-    return CompletionList(is_incomplete=False, items=items)
+    Parameters:
+    - ls: The language server instance.
+    - params: WorkspaceSymbolParams object containing the query.
+
+    Returns:
+    - list[WorkspaceSymbol]: At most WORKSPACE_SYMBOL_LIMIT symbols whose
+      name matches the query exactly, starts with it, contains it or is
+      similar to it, in this order.
+    """
+    matches = ls.snapshot.symbol_index.search(params.query,
+                                              WORKSPACE_SYMBOL_LIMIT)
+
+    return [WorkspaceSymbol(name=name,
+                            kind=SYMBOL_KINDS.get(type(entity),
+                                                  SymbolKind.Variable),
+                            location=_get_location(entity),
+                            container_name=container or None)
+            for name, entity, container in matches]
+
+
+@trlc_server.feature(TEXT_DOCUMENT_DOCUMENT_SYMBOL)
+def document_symbol(ls, params: DocumentSymbolParams):
+    """
+    Provides the outline of a file: the entities declared in it, with the
+    sections, types and enumerations containing them.
+
+    Parameters:
+    - ls: The language server instance.
+    - params: DocumentSymbolParams object containing the uri.
+
+    Returns:
+    - list[DocumentSymbol] or None if the file has not been parsed.
+    """
+    outline = ls.snapshot.outlines.get(_get_path(params.text_document.uri))
+    return None if outline is None else outline.symbols
+
+
+@trlc_server.feature(TEXT_DOCUMENT_FOLDING_RANGE)
+def folding_range(ls, params: FoldingRangeParams):
+    """
+    Provides the folding ranges of a file: brackets and comments spanning
+    several lines, runs of line comments and of imports.
+
+    Parameters:
+    - ls: The language server instance.
+    - params: FoldingRangeParams object containing the uri.
+
+    Returns:
+    - list[FoldingRange] or None if the file has not been parsed.
+    """
+    outline = ls.snapshot.outlines.get(_get_path(params.text_document.uri))
+    return None if outline is None else outline.folding_ranges
 
 
 @trlc_server.feature(TEXT_DOCUMENT_TYPE_DEFINITION)
@@ -585,14 +1159,13 @@ def goto_type_definition(ls, params: TypeDefinitionParams):
     uri         = params.text_document.uri
     file_path   = _get_path(uri)
 
-    with ls.data_lock:
-        try:
-            tokens  = ls.all_files[file_path].lexer.tokens
-        except KeyError:
-            ls.window_show_message(
-                ShowMessageParams(type=MessageType.Info,
-                                  message=WAIT_PARSING))
-            return None
+    try:
+        tokens  = ls.snapshot.token_indexes[file_path]
+    except KeyError:
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message=WAIT_PARSING))
+        return None
 
     cur_tok     = _get_token(tokens, cursor_line, cursor_col, greedy=True)
     ast_loc     = None
@@ -609,82 +1182,89 @@ def goto_type_definition(ls, params: TypeDefinitionParams):
 
     # Get the trlc.ast.Entity object at the cursor position or from another
     # location where the Entity is explicitly defined.
-    ast_obj = _get_ast_entity(cur_tok)
+    ast_obj = get_ast_entity(cur_tok)
     ast_loc = _get_location(ast_obj)
 
     return ast_loc if ast_loc else None
 
 
-@trlc_server.feature(TEXT_DOCUMENT_REFERENCES)
-def references(ls, params: ReferenceParams):
+def _not_cancelled():
+    return False
+
+
+def _find_references(snapshot, cur_tok, cancelled):
+    """
+    Finds the locations of all identifier tokens referring to the entity of
+    the given token, across all parsed files.
+
+    Parameters:
+    - snapshot (Parse_Snapshot): The parse the token is from.
+    - cur_tok (Token or None): The token at the cursor position.
+    - cancelled: A function returning True once the request was cancelled;
+      it is checked before each file.
+
+    Returns:
+    - list[Location] or None if the token does not refer to an entity or the
+      request was cancelled.
+    """
+    # Exit condition: If there is no token at the cursor position
+    # or the token lacks an ast_link.
+    # We specifically consider only identifiers, excluding Builtins.
+    if (cur_tok is None or
+            cur_tok.ast_link is None or
+            cur_tok.kind not in ("IDENTIFIER", "DOT") or
+            isinstance(cur_tok.ast_link, (trlc.ast.Builtin_Type,
+                                          trlc.ast.Builtin_Function))):
+        return None
+
+    # Get the trlc.ast.Entity object at the cursor position or from another
+    # location where the Entity is explicitly defined.
+    ast_obj = get_ast_entity(cur_tok)
+    if ast_obj is None:
+        return None
+
+    locations = []
+    for refs in snapshot.reference_index.references(ast_obj):
+        if cancelled():
+            return None
+        locations.extend(_get_location(tok) for tok in refs)
+    return locations
+
+
+@trlc_server.feature(TEXT_DOCUMENT_REFERENCES, worker=True)
+def references(ls, params: ReferenceParams, cancelled=_not_cancelled):
     """
     Finds all references for the identifier token at a given cursor position
     linked to identical AST objects of types Entity, Record_Reference,
-    Name_Reference or Enumeration_Literal.
+    Name_Reference or Enumeration_Literal. Runs on a worker thread.
 
     Parameters:
     - ls: The language server instance.
     - params: ReferenceParams object containing the cursor position and the
       uri.
+    - cancelled: A function returning True once the client cancelled the
+      request.
 
     Returns:
     - locations: A list of Location objects representing the references to the
       identifier. If no references are found, None is returned.
     """
-    pars        = []
-    locations   = []
     cursor_line = params.position.line
     cursor_col  = params.position.character
     uri         = params.text_document.uri
     file_path   = _get_path(uri)
 
-    with ls.data_lock:
-        try:
-            cur_pkg = ls.all_files[file_path].cu.package
-            imp_pkg = ls.all_files[file_path].cu.imports
-            tokens  = ls.all_files[file_path].lexer.tokens
-            all_files = ls.all_files
-        except KeyError:
-            ls.window_show_message(
-                ShowMessageParams(type=MessageType.Info,
-                                  message=WAIT_PARSING))
-            return None
-
-    cur_tok     = _get_token(tokens, cursor_line, cursor_col, greedy=True)
-
-    # Exit condition: If there is no token at the cursor position
-    # or the token lacks an ast_link.
-    # We specifically consider only identifiers, excluding Builtins.
-    if (cur_tok is None or
-            cur_tok.ast_link is None or
-            cur_tok.kind not in ("IDENTIFIER", "DOT") or
-            isinstance(cur_tok.ast_link, (trlc.ast.Builtin_Type,
-                                          trlc.ast.Builtin_Function))):
+    snapshot = ls.snapshot
+    try:
+        tokens  = snapshot.token_indexes[file_path]
+    except KeyError:
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message=WAIT_PARSING))
         return None
 
-    # Get the trlc.ast.Entity object at the cursor position or from another
-    # location where the Entity is explicitly defined.
-    ast_obj = _get_ast_entity(cur_tok)
-
-    # Filter for all relevant parsers
-    for par in all_files.values():
-        if (par.lexer.tokens and
-                (cur_pkg == par.cu.package or
-                    par.cu.package in imp_pkg or
-                    cur_pkg in par.cu.imports)):
-            pars.append(par)
-
-    # Iterate through all relevant Token_Streams and their tokens.
-    for par in pars:
-        for tok in par.lexer.tokens:
-            # We proceed to the next iteration if we encounter a token that is
-            # not an identifier.
-            if tok.kind != "IDENTIFIER":
-                continue
-            # Retrive the trlc.ast.Entity object behind the link and check for
-            # equality.
-            if ast_obj == _get_ast_entity(tok):
-                locations.append(_get_location(tok))
+    cur_tok     = _get_token(tokens, cursor_line, cursor_col, greedy=True)
+    locations   = _find_references(snapshot, cur_tok, cancelled)
 
     return locations if locations else None
 
@@ -714,14 +1294,13 @@ def hover(ls, params: TextDocumentPositionParams):
     uri         = params.text_document.uri
     file_path   = _get_path(uri)
 
-    with ls.data_lock:
-        try:
-            tokens  = ls.all_files[file_path].lexer.tokens
-        except KeyError:
-            ls.window_show_message(
-                ShowMessageParams(type=MessageType.Info,
-                                  message=WAIT_PARSING))
-            return None
+    try:
+        tokens  = ls.snapshot.token_indexes[file_path]
+    except KeyError:
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message=WAIT_PARSING))
+        return None
 
     cur_tok     = _get_token(tokens, cursor_line, cursor_col)
 
@@ -735,7 +1314,7 @@ def hover(ls, params: TextDocumentPositionParams):
                                           trlc.ast.Builtin_Function))):
         return None
 
-    ast_obj = _get_ast_entity(cur_tok)
+    ast_obj = get_ast_entity(cur_tok)
     tok_loc = _get_location(cur_tok)
     tok_rng = tok_loc.range
 
@@ -748,17 +1327,19 @@ def hover(ls, params: TextDocumentPositionParams):
     return Hover(contents=desc, range=tok_rng)
 
 
-@trlc_server.feature(TEXT_DOCUMENT_RENAME)
-def rename(ls, params: RenameParams):
+@trlc_server.feature(TEXT_DOCUMENT_RENAME, worker=True)
+def rename(ls, params: RenameParams, cancelled=_not_cancelled):
     """
     Performs a rename action for a name that is not a Builtin_Type or
     Builtin_Function at a given cursor position. The renaming is only allowed
     if all files in the workspace are syntactically valid TRLC. Renaming is
-    only available if parsing is set to 'full'.
+    only available if parsing is set to 'full'. Runs on a worker thread.
 
     Parameters:
     - ls: The language server instance.
     - params: RenameParams object containing the cursor position and the uri.
+    - cancelled: A function returning True once the client cancelled the
+      request.
 
     Returns:
     - WorkspaceEdit: A WorkspaceEdit object containing the changes to be made.
@@ -772,14 +1353,14 @@ def rename(ls, params: RenameParams):
     uri         = params.text_document.uri
     file_path   = _get_path(uri)
 
-    with ls.data_lock:
-        try:
-            tokens  = ls.all_files[file_path].lexer.tokens
-        except KeyError:
-            ls.window_show_message(
-                ShowMessageParams(type=MessageType.Info,
-                                  message=WAIT_PARSING))
-            return None
+    snapshot = ls.snapshot
+    try:
+        tokens  = snapshot.token_indexes[file_path]
+    except KeyError:
+        ls.window_show_message(
+            ShowMessageParams(type=MessageType.Info,
+                              message=WAIT_PARSING))
+        return None
 
     cur_tok     = _get_token(tokens, cursor_line, cursor_col, greedy=True)
     new_text    = params.new_name
@@ -794,7 +1375,7 @@ def rename(ls, params: RenameParams):
 
     # Exit if parsing is set to partial or not set at all, as the default is
     # partial parsing.
-    if ls.parse_partial is True:
+    if snapshot.parse_partial is True:
         ls.window_show_message(
             ShowMessageParams(
                 type=MessageType.Warning,
@@ -814,7 +1395,7 @@ def rename(ls, params: RenameParams):
         return WorkspaceEdit(document_changes=files_changes)
 
     # Check if there are any errors in TRLC
-    for diagnostics in ls.diagnostic_history.values():
+    for diagnostics in snapshot.diagnostics.values():
         is_valid &= not any(diagnostic.severity == 1 for
                             diagnostic in diagnostics)
 
@@ -828,7 +1409,9 @@ def rename(ls, params: RenameParams):
         return WorkspaceEdit(document_changes=files_changes)
 
     # Find all references to the symbol being renamed
-    locs = references(ls, params) or []
+    locs = _find_references(snapshot, cur_tok, cancelled) or []
+    if cancelled():
+        return None
 
     # Group references by URI and store the corresponding TextEdit objects
     if locs:
@@ -849,30 +1432,33 @@ def rename(ls, params: RenameParams):
     return WorkspaceEdit(document_changes=files_changes)
 
 
-@trlc_server.feature(
-    TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
-    SemanticTokensLegend(token_types=SEMANTIC_TOKEN_TYPES, token_modifiers=[]),
-)
-def semantic_tokens(ls: TrlcLanguageServer, params: SemanticTokensParams):
-    uri = params.text_document.uri
-    file_path = _get_path(uri)
-
-    # Reuse tokens from the last parse when available (provides AST-aware
-    # type classification for IDENTIFIER tokens).
-    with ls.data_lock:
-        parsed = ls.all_files.get(file_path)
-    if parsed and parsed.lexer.tokens:
-        all_tokens = parsed.lexer.tokens
-    else:
-        # Fallback: lex the file independently (no AST links available).
-        # IDENTIFIER tokens are skipped in this path since their semantic type
-        # cannot be determined without the AST.
-        doc = ls.workspace.get_text_document(uri)
-        if not doc.source:
-            return SemanticTokens(data=[])
+def _get_semantic_tokens_key(ls, uri):
+    """Return the key under which the encoded semantic tokens of the
+    document are cached: the Semantic_Tokens of the last parse, or the
+    version of the document if it was not parsed."""
+    semantic = ls.snapshot.semantic_tokens.get(_get_path(uri))
+    if semantic and semantic.token_index.tokens:
+        return semantic
+    return ls.workspace.get_text_document(uri).version
+
+
+def _get_semantic_tokens(ls, uri):
+    """Return the Semantic_Tokens of the document, and the key under which
+    their encoding can be cached."""
+    # Use the semantic tokens of the last parse when available (provides
+    # AST-aware type classification for IDENTIFIER tokens).
+    key = _get_semantic_tokens_key(ls, uri)
+    if isinstance(key, Semantic_Tokens):
+        return key, key
+
+    # Fallback: lex the file independently (no AST links available).
+    # IDENTIFIER tokens are skipped in this path since their semantic type
+    # cannot be determined without the AST.
+    doc = ls.workspace.get_text_document(uri)
+    all_tokens = []
+    if doc.source:
         mh = trlc.errors.Message_Handler()
         lexer = trlc.lexer.TRLC_Lexer(mh, uri, doc.source)
-        all_tokens = []
         while True:
             try:
                 tok = lexer.token()
@@ -881,27 +1467,59 @@ def semantic_tokens(ls: TrlcLanguageServer, params: SemanticTokensParams):
             if tok is None:
                 break
             all_tokens.append(tok)
+    return Semantic_Tokens(Token_Index(all_tokens)), key
 
-    # Encode tokens in LSP semantic token delta format.
-    # https://microsoft.github.io/language-server-protocol/specifications/lsp/3.17/specification/#textDocument_semanticTokens
-    cur_line = 1
-    cur_col  = 0
-    data     = []
-    for token in all_tokens:
-        sem_type = _get_token_semantic_type(token)
-        if sem_type is None:
-            continue
-
-        delta_line = token.location.line_no - cur_line
-        cur_line   = token.location.line_no
-        if delta_line > 0:
-            delta_start = token.location.col_no - 1
-            cur_col     = token.location.col_no - 1
-        else:
-            delta_start = token.location.col_no - 1 - cur_col
-            cur_col     = token.location.col_no - 1
-        length = token.location.end_pos - token.location.start_pos + 1
-        assert length > 0
-        data += [delta_line, delta_start, length, sem_type, 0]
 
-    return SemanticTokens(data=data)
+def _get_full_semantic_tokens(ls, uri):
+    """Return the cache key, result id and encoded semantic tokens of the
+    whole document. The encoding is precomputed for parsed files; the
+    result id only changes with the parse or the document version, and
+    documents that were not parsed are only lexed again when their version
+    changes."""
+    cached = ls.semantic_results.get(uri)
+    if cached and cached[0] == _get_semantic_tokens_key(ls, uri):
+        return cached
+
+    semantic, key = _get_semantic_tokens(ls, uri)
+    ls.semantic_results_id += 1
+    cached = (key, str(ls.semantic_results_id), semantic.data)
+    ls.semantic_results[uri] = cached
+    return cached
+
+
+@trlc_server.feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL,
+                     SEMANTIC_TOKENS_LEGEND)
+def semantic_tokens(ls: TrlcLanguageServer, params: SemanticTokensParams):
+    _, result_id, data = _get_full_semantic_tokens(ls,
+                                                   params.text_document.uri)
+    return SemanticTokens(data=data, result_id=result_id)
+
+
+@trlc_server.feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_FULL_DELTA,
+                     SEMANTIC_TOKENS_LEGEND)
+def semantic_tokens_delta(ls: TrlcLanguageServer,
+                          params: SemanticTokensDeltaParams):
+    uri = params.text_document.uri
+    previous = ls.semantic_results.get(uri)
+    _, result_id, data = _get_full_semantic_tokens(ls, uri)
+
+    # Only the last result sent for a document is known
+    if previous is None or previous[1] != params.previous_result_id:
+        return SemanticTokens(data=data, result_id=result_id)
+    if previous[1] == result_id:
+        return SemanticTokensDelta(edits=[], result_id=result_id)
+    return SemanticTokensDelta(edits=[diff_semantic_tokens(previous[2],
+                                                           data)],
+                               result_id=result_id)
+
+
+@trlc_server.feature(TEXT_DOCUMENT_SEMANTIC_TOKENS_RANGE,
+                     SEMANTIC_TOKENS_LEGEND)
+def semantic_tokens_range(ls: TrlcLanguageServer,
+                          params: SemanticTokensRangeParams):
+    semantic, _ = _get_semantic_tokens(ls, params.text_document.uri)
+    start = params.range.start
+    end = params.range.end
+    return SemanticTokens(data=semantic.encode(
+        semantic.token_index.span(start.line, start.character,
+                                  end.line, end.character)))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""The result of a parse, as read by the request handlers."""
+
+import copy
+from types import MappingProxyType
+
+import trlc.ast
+
+from .indexes import Completion_Index, Reference_Index, Symbol_Index
+
+
+class Parse_Snapshot:
+    """Everything the request handlers need from a parse: the symbol
+    table, the parsers and indexes of the files, and the diagnostics.
+
+    The validator thread builds a new snapshot for every parse and
+    publishes it by assigning it to TrlcLanguageServer.snapshot, which is
+    atomic. A snapshot is not changed once published, so handlers read
+    it without locking: they take the current one once and use it
+    throughout, even if a newer one is published meanwhile. The dicts
+    handlers look up per file, such as the outlines, are read-only views.
+
+    generation is the generation of the events the parse is based on.
+    """
+
+    def __init__(self, *, generation=0, symbols=None, all_files=None,
+                 token_indexes=None, semantic_tokens=None, outlines=None,
+                 reference_index=None, symbol_index=None,
+                 completion_index=None, diagnostics=None,
+                 parse_partial=True):
+        self.generation = generation
+        self.symbols = symbols or trlc.ast.Symbol_Table()
+        self.all_files = all_files or {}
+        self.token_indexes = token_indexes or {}
+        self.semantic_tokens = semantic_tokens or {}
+        self.outlines = MappingProxyType(outlines or {})
+        self.reference_index = reference_index or Reference_Index()
+        self.symbol_index = symbol_index or Symbol_Index()
+        self.completion_index = (completion_index or
+                                 Completion_Index(self.symbols))
+        self.diagnostics = diagnostics or {}
+        self.parse_partial = parse_partial
+
+    def replace(self, **changes):
+        """Return a copy of the snapshot with the given attributes
+        replaced."""
+        snapshot = copy.copy(self)
+        for name, value in changes.items():
+            assert hasattr(snapshot, name)
+            setattr(snapshot, name, value)
+        return snapshot
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""The TRLC front end, reading from the editor and the workspace.
+
+Importing this module imports all of TRLC, including CVC5, which takes a
+while; the server does so in the background once it is initialized.
+"""
+
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from lsprotocol.types import (
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
+)
+from trlc.ast import Package, Symbol_Table
+from trlc.parser import Parser
+from trlc.trlc import Source_Manager
+
+from .cache import Cached_Token_Stream, encode_tokens
+from .inventory import Workspace_Inventory
+from .trlc_utils import Parse_Cancelled, disk_stamp, path_to_uri
+
+
+class Vscode_Source_Manager(Source_Manager):
+    """Reimplementation of TRLC's Source_Manager to read from vscode's
+    workspace."""
+
+    def __init__(self, mh, fh, ls, verify_mode=True,  # pylint: disable=R0917
+                 exclude_patterns=None, cancelled=None, token_cache=None,
+                 inventory=None, lexer_pool=None):
+        super().__init__(mh=mh, verify_mode=verify_mode)
+        self.fh = fh
+        self.cancelled = cancelled
+        self.token_cache = token_cache
+        self.token_stamps = {}
+        self.lexer_pool = lexer_pool
+        self.prelexed = {}
+        self.timings = {}
+        self.current_phase = None
+        self.verify_ready = False
+        self.progress = ls.work_done_progress
+        self.ptoken = None
+        self.reused_files = {}
+        self.reused_packages = set()
+        self.reused_state = []
+        # Size and modification time of the files read from disk, taken
+        # before reading them
+        self.file_stamps = {}
+        self.package_graph = {}
+        # Mirror TRLC CLI default: exclude bazel-* directories.
+        self.exclude_patterns = [re.compile(r"^bazel-.*$")]
+        if exclude_patterns:
+            for pattern in exclude_patterns:
+                self.exclude_patterns.append(re.compile(pattern))
+        self.inventory = inventory or Workspace_Inventory()
+        self.inventory.set_patterns(self.exclude_patterns)
+
+    @contextmanager
+    def timed(self, phase):
+        """Add the time spent in the context to the given phase in timings.
+        Time spent in a phase nested in another one counts for the outer
+        phase only."""
+        if self.current_phase is not None:
+            yield
+            return
+        self.current_phase = phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current_phase = None
+            self.timings[phase] = (self.timings.get(phase, 0.0) +
+                                   time.perf_counter() - start)
+
+    def check_cancelled(self):
+        """Raise Parse_Cancelled if the parse is no longer wanted. Called
+        at file boundaries."""
+        future = self.progress.tokens.get(self.ptoken)
+        if ((self.cancelled is not None and self.cancelled()) or
+                (future is not None and future.cancelled())):
+            raise Parse_Cancelled()
+
+    def process(self):
+        try:
+            result = super().process()
+        except Parse_Cancelled:
+            self.callback_parse_end()
+            raise
+        self.store_tokens()
+        return result
+
+    def create_parser(self, file_name, file_content=None, primary_file=True):
+        if (self.token_cache is None or
+                not file_name.endswith((".rsl", ".trlc"))):
+            return super().create_parser(file_name, file_content,
+                                         primary_file)
+
+        from_disk = file_content is None
+        if from_disk:
+            try:
+                with open(file_name, "r", encoding="UTF-8") as fd:
+                    file_content = fd.read()
+            except (OSError, UnicodeDecodeError):
+                # Let TRLC report the problem
+                return super().create_parser(file_name, None, primary_file)
+
+        stamp = self.token_cache.stamp(file_name, file_content, from_disk)
+        prelexed = self.prelexed.pop(file_name, None)
+        if prelexed is not None and prelexed[0] == stamp:
+            cached_tokens = prelexed[1]
+        else:
+            cached_tokens = self.token_cache.get(file_name, stamp)
+        if cached_tokens is None:
+            self.token_stamps[file_name] = stamp
+            return super().create_parser(file_name, file_content,
+                                         primary_file)
+
+        lexer = Cached_Token_Stream(self.mh, file_name, file_content,
+                                    cached_tokens)
+        return Parser(mh=self.mh,
+                      stab=self.stab,
+                      file_name=file_name,
+                      lint_mode=self.lint_mode,
+                      error_recovery=self.error_recovery,
+                      primary_file=primary_file,
+                      lexer=lexer)
+
+    def prelex(self, files):
+        """Lex the given (file name, content or None) pairs in the lexer
+        pool, ahead of registering them."""
+        if self.lexer_pool is None or self.token_cache is None:
+            return
+        jobs = [(file_name, file_content)
+                for file_name, file_content in files
+                if file_name.replace("\\", "/") not in self.reused_files]
+        with self.timed("lex"):
+            self.prelexed.update(self.lexer_pool.lex(jobs,
+                                                     self.check_cancelled))
+
+    def store_tokens(self):
+        """Store the tokens of all files that were lexed to the end in the
+        token cache."""
+        for file_name, stamp in self.token_stamps.items():
+            lexer = self.all_files[file_name].lexer
+            if lexer.lexpos >= lexer.length:
+                self.token_cache.put(file_name, stamp,
+                                     encode_tokens(lexer.tokens))
+
+    def signal_progress(self):
+        self.check_cancelled()
+        super().signal_progress()
+
+    def reuse(self, stab, all_files, packages):
+        """Carry over the given packages, and the parsers of the files
+        declaring them, from a previous parse. Files of reused packages
+        are not lexed or parsed again.
+
+        The reused packages still belong to the previous parse. What is
+        changed on them to link them into the new symbol table is saved,
+        so that restore_reused can undo it if the parse is abandoned."""
+        new_stab = Symbol_Table()
+        for key, entity in stab.table.items():
+            if isinstance(entity, Package):
+                if entity.name not in packages:
+                    continue
+                self.reused_state.append(
+                    (entity, entity.symbols.imported,
+                     getattr(entity, "sub_packages", None),
+                     getattr(entity, "parent", None)))
+                entity.symbols.imported = [
+                    new_stab if imported is stab else imported
+                    for imported in entity.symbols.imported
+                ]
+                # The package hierarchy is rebuilt by build_graph
+                if hasattr(entity, "sub_packages"):
+                    entity.sub_packages = Symbol_Table()
+                    entity.parent = None
+            new_stab.table[key] = entity
+        self.stab = new_stab
+        self.reused_packages = set(packages)
+        self.reused_files = {
+            file_name: parser
+            for file_name, parser in all_files.items()
+            if parser.cu.package and parser.cu.package.name in packages
+        }
+
+    def restore_reused(self):
+        """Link the reused packages into the symbol table of the previous
+        parse again, as they were before reuse."""
+        for entity, imported, sub_packages, parent in self.reused_state:
+            entity.symbols.imported = imported
+            if sub_packages is not None:
+                entity.sub_packages = sub_packages
+                entity.parent = parent
+        self.reused_state = []
+
+    def reuse_failed(self):
+        """True if a newly parsed file declares one of the reused packages,
+        in which case the result is inconsistent and a full parse is
+        required."""
+        return any(parser.cu.package and
+                   parser.cu.package.name in self.reused_packages
+                   for parser in self.all_files.values())
+
+    def register_file(self, file_name, file_content=None, primary=True):
+        self.check_cancelled()
+        if file_name.replace("\\", "/") in self.reused_files:
+            return True
+        if file_content is None:
+            stamp = disk_stamp(file_name)
+            # The file may have been deleted since the inventory was
+            # updated; the file system event for it is still on its way.
+            if stamp is None:
+                return True
+            self.file_stamps[file_name.replace("\\", "/")] = stamp
+        with self.timed("register"):
+            return super().register_file(file_name, file_content, primary)
+
+    def build_graph(self):
+        with self.timed("graph"):
+            ok = super().build_graph()
+        for (pkg_name, _), deps in self.dep_graph.items():
+            self.package_graph.setdefault(pkg_name, set()).update(
+                dep_name for dep_name, _ in deps if dep_name != pkg_name)
+        # Reused packages are already elaborated, so they must not hold up
+        # the packages depending on them.
+        reused_nodes = {(pkg_name, kind)
+                        for pkg_name in self.reused_packages
+                        for kind in ("rsl", "trlc")}
+        for deps in self.dep_graph.values():
+            deps -= reused_nodes
+        return ok
+
+    def parse_rsl_files(self):
+        self.mh.parsing = True
+        try:
+            with self.timed("parse_rsl"):
+                return super().parse_rsl_files()
+        finally:
+            self.mh.parsing = False
+
+    def parse_trlc_files(self):
+        # TRLC only lints (and verifies) the types if there are no errors
+        # at this point
+        self.verify_ready = self.mh.errors == 0
+        self.mh.parsing = True
+        try:
+            with self.timed("parse_trlc"):
+                return super().parse_trlc_files()
+        finally:
+            self.mh.parsing = False
+
+    def resolve_record_references(self):
+        with self.timed("resolve"):
+            return super().resolve_record_references()
+
+    def perform_checks(self):
+        with self.timed("checks"):
+            return super().perform_checks()
+
+    def callback_parse_begin(self):
+        self.ptoken = str(uuid.uuid4())
+        self.progress.create(self.ptoken)
+        self.progress.begin(
+            self.ptoken,
+            WorkDoneProgressBegin(
+                title="Parsing", percentage=0, cancellable=True
+            ),
+        )
+
+    def callback_parse_progress(self, progress):
+        assert isinstance(progress, int)
+        self.progress.report(
+            self.ptoken,
+            WorkDoneProgressReport(
+                message="Parsing (%i%%)" % progress, percentage=progress
+            ),
+        )
+
+    def callback_parse_end(self):
+        future = self.progress.tokens.pop(self.ptoken, None)
+        if future is not None and future.cancelled():
+            message = "Cancelled"
+        else:
+            message = "Finished"
+        self.progress.end(self.ptoken, WorkDoneProgressEnd(message=message))
+
+    def register_include(self, dir_name):
+        with self.timed("discovery"):
+            file_paths = self.inventory.files(dir_name)
+        self.includes.update((os.path.abspath(file_path), file_path)
+                             for file_path in file_paths)
+
+    def register_workspace(self, dir_name):
+        ok = True
+        with self.timed("discovery"):
+            file_paths = self.inventory.files(dir_name)
+        files = [(file_path, self.fh.files.get(path_to_uri(file_path)))
+                 for file_path in file_paths]
+        self.prelex(files)
+        for file_path, file_content in files:
+            ok &= self.register_file(file_path, file_content)
+        return ok
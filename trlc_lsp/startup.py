@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+
+"""Measurement of the startup of the server, for --startup-report."""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# Written to stderr by the measured process between its phases, in between
+# the lines of -X importtime
+MARKER = "trlc-startup: "
+
+TOP_MODULES = 15
+
+
+def measure():
+    """Runs in a fresh interpreter started with -X importtime: start the
+    server like __main__ does, answer an initialize request and warm up
+    like the parser thread does, printing the seconds per phase."""
+    # pylint: disable=C0415
+    timings = {"started": time.time()}
+    start = time.perf_counter()
+    from lsprotocol.types import ClientCapabilities, InitializeParams
+
+    from .server import trlc_server
+    timings["import"] = time.perf_counter() - start
+    print(MARKER + "initialize", file=sys.stderr, flush=True)
+
+    with open(os.devnull, "wb") as devnull:
+        start = time.perf_counter()
+        trlc_server.protocol.set_writer(devnull)
+        for _ in trlc_server.protocol.lsp_initialize(InitializeParams(
+                capabilities=ClientCapabilities())):
+            pass
+        timings["initialize"] = time.perf_counter() - start
+    print(MARKER + "deferred", file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    trlc_server.warm_up()
+    timings["deferred"] = time.perf_counter() - start
+    print(json.dumps(timings), flush=True)
+
+
+def parse_importtime(lines):
+    """Return the (self, cumulative) microseconds and the name of every
+    module imported, by phase."""
+    phases = {"import": []}
+    phase = phases["import"]
+    for line in lines:
+        if line.startswith(MARKER):
+            phase = phases.setdefault(line[len(MARKER):].strip(), [])
+        elif line.startswith("import time:") and "|" in line:
+            own, cumulative, name = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                phase.append((int(own), int(cumulative), name.strip()))
+    return phases
+
+
+def report(output=sys.stdout):
+    """Start the server in a fresh interpreter, and print how long the
+    phases of its startup take and which imports contribute most."""
+    start = time.time()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "from trlc_lsp.startup import measure; measure()"],
+        capture_output=True, text=True, check=False)
+    if process.returncode != 0:
+        output.write(process.stderr)
+        return 1
+    timings = json.loads(process.stdout.splitlines()[-1])
+    phases = parse_importtime(process.stderr.splitlines())
+
+    def write(text=""):
+        output.write(text + "\n")
+
+    write("TRLC language server startup (Python %s, %s)" %
+          (platform.python_version(), sys.executable))
+    write()
+    interpreter = timings["started"] - start
+    ready = interpreter + timings["import"] + timings["initialize"]
+    for label, seconds in (
+            ("interpreter startup", interpreter),
+            ("import trlc_lsp.server", timings["import"]),
+            ("initialize request", timings["initialize"]),
+            ("until initialize is answered", ready),
+            ("deferred to the parser thread", timings["deferred"])):
+        write("  %-34s %9.1f ms" % (label, seconds * 1000))
+
+    write()
+    write("Import time by package, in ms (own time of its modules):")
+    write("  %-24s %16s %10s" % ("", "before initialize", "deferred"))
+    packages = {}
+    for n, phase in enumerate(("import", "deferred")):
+        for own, _, name in phases.get(phase, []):
+            package = name.split(".")[0]
+            packages.setdefault(package, [0, 0])[n] += own
+    for package, (before, deferred) in sorted(
+            packages.items(), key=lambda item: -sum(item[1])):
+        if before + deferred >= 1000:
+            write("  %-24s %16.1f %10.1f" %
+                  (package, before / 1000, deferred / 1000))
+
+    for phase, title in (("import", "before initialize"),
+                         ("deferred", "deferred")):
+        write()
+        write("Slowest imports %s, in ms (own / cumulative):" % title)
+        for own, cumulative, name in sorted(phases.get(phase, []),
+                                            reverse=True)[:TOP_MODULES]:
+            write("  %-40s %8.1f %8.1f" %
+                  (name, own / 1000, cumulative / 1000))
+    return 0
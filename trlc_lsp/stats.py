@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Timing and counters of the language server, served by the trlc/stats
+request and optionally written to the log."""
+
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+# The log file only gets warnings, but the statistics are wanted in it
+# when they are enabled.
+STATS_LOGGER = logging.getLogger("trlc_lsp.stats")
+STATS_LOGGER.setLevel(logging.INFO)
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500,
+              1000, 2000, 5000, 10000, 30000)
+
+RECENT_PARSES = 20
+
+
+class Histogram:
+    """Counts of durations in buckets of exponentially growing size."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        n = 0
+        while n < len(BUCKETS_MS) and ms > BUCKETS_MS[n]:
+            n += 1
+        self.buckets[n] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        buckets = {}
+        for n, count in enumerate(self.buckets):
+            if count:
+                label = ("<=%ums" % BUCKETS_MS[n] if n < len(BUCKETS_MS)
+                         else ">%ums" % BUCKETS_MS[-1])
+                buckets[label] = count
+        return {"count": self.count,
+                "total_ms": round(self.total * 1000, 3),
+                "mean_ms": round(self.total * 1000 / self.count, 3)
+                if self.count else 0,
+                "max_ms": round(self.max * 1000, 3),
+                "buckets": buckets}
+
+
+class Server_Stats:
+    """Histograms of the phases of parses and of request handlers, plus
+    counters. Updated from the pygls and validator threads.
+
+    The periodic dump logs the dict returned by get_stats, by default the
+    snapshot; the server passes its own, which adds the counters of its
+    caches."""
+
+    def __init__(self, get_stats=None):
+        self.get_stats = get_stats or self.snapshot
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}
+        self.handlers = {}
+        self.counters = {}
+        self.queue_depth = {"count": 0, "total": 0, "max": 0}
+        self.recent_parses = deque(maxlen=RECENT_PARSES)
+        self.dump_interval = 0
+        self.dump_wakeup = threading.Event()
+        self.dump_thread = None
+
+    def add_phase(self, phase, seconds):
+        with self.lock:
+            self.phases.setdefault(phase, Histogram()).add(seconds)
+
+    def add_handler(self, method, seconds):
+        with self.lock:
+            self.handlers.setdefault(method, Histogram()).add(seconds)
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def add_queue_depth(self, depth):
+        """Record the number of events drained by the validator at once."""
+        with self.lock:
+            self.queue_depth["count"] += 1
+            self.queue_depth["total"] += depth
+            self.queue_depth["max"] = max(self.queue_depth["max"], depth)
+
+    def add_parse(self, parse, phases):
+        """Record a parse, given as a dict (e.g. with its generation and
+        the number of files parsed), and the seconds spent per phase."""
+        parse["phases_ms"] = {phase: round(seconds * 1000, 3)
+                              for phase, seconds in phases.items()}
+        for phase, seconds in phases.items():
+            self.add_phase(phase, seconds)
+        self.count("parses")
+        with self.lock:
+            self.recent_parses.append(parse)
+
+    def timed_handler(self, method, handler):
+        """Return handler wrapped to record its latency."""
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    self.add_handler(method, time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(handler)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.add_handler(method, time.perf_counter() - start)
+        return timed
+
+    def snapshot(self):
+        """Return all statistics as a JSON compatible dict."""
+        with self.lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 3),
+                "phases": {phase: histogram.to_dict()
+                           for phase, histogram in self.phases.items()},
+                "handlers": {method: histogram.to_dict()
+                             for method, histogram in self.handlers.items()},
+                "counters": dict(self.counters),
+                "queue_depth": dict(self.queue_depth),
+                "recent_parses": list(self.recent_parses),
+            }
+
+    def set_dump_interval(self, seconds):
+        """Write the statistics to the log every given number of seconds;
+        0 stops."""
+        self.dump_interval = seconds
+        self.dump_wakeup.set()
+        if seconds > 0 and self.dump_thread is None:
+            self.dump_thread = threading.Thread(target=self.dump_loop,
+                                                name="TRLC Stats Thread",
+                                                daemon=True)
+            self.dump_thread.start()
+
+    def dump_loop(self):
+        while True:
+            self.dump_wakeup.wait(self.dump_interval or None)
+            if self.dump_wakeup.is_set():
+                # The interval changed; start waiting again
+                self.dump_wakeup.clear()
+                continue
+            STATS_LOGGER.info("TRLC stats: %s", json.dumps(self.get_stats()))
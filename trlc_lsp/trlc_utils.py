@@ -18,22 +18,19 @@
 # You should have received a copy of the GNU General Public License
 # along with TRLC. If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import os
-import re
 import urllib.parse
-import uuid
 
 from lsprotocol.types import (
     Diagnostic,
     DiagnosticSeverity,
     Position,
     Range,
-    WorkDoneProgressBegin,
-    WorkDoneProgressEnd,
-    WorkDoneProgressReport,
 )
+from trlc.ast import (Entity, Enumeration_Literal, Name_Reference,
+                      Record_Reference)
 from trlc.errors import Kind, Message_Handler, TRLC_Error
-from trlc.trlc import Source_Manager
 
 
 kind_to_severity_mapping = {
@@ -45,12 +42,54 @@ kind_to_severity_mapping = {
 }
 
 
+def path_to_uri(file_name):
+    url = urllib.parse.quote(file_name.replace("\\", "/"))
+    return urllib.parse.urlunparse(("file", "", url, "", "", ""))
+
+
+def disk_stamp(file_name):
+    """Return the size and modification time of a file, or None if it
+    does not exist."""
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def get_ast_entity(token):
+    """
+    Extracts and returns the AST object of type 'trlc.ast.Entity' linked with
+    the token or any references associated with it.
+
+    Parameters:
+    - token (trlc.lexer.Token): The token from which to extract the AST object.
+
+    Returns:
+    - trlc.ast.Entity or None if the token is not linked with the required
+    types.
+    """
+    tok_lk = token.ast_link
+
+    # Get the Entity type based on the type of the attribute token.ast_link
+    return (
+        tok_lk if isinstance(tok_lk, Entity) else
+        tok_lk.entity if isinstance(tok_lk, Name_Reference) else
+        tok_lk.target if isinstance(tok_lk, Record_Reference) else
+        tok_lk.value if isinstance(tok_lk, Enumeration_Literal) else
+        None)
+
+
 class Vscode_Message_Handler(Message_Handler):
     """Reimplementation of TRLC's Message_Handler to emit the diagnostics."""
 
     def __init__(self):
         super().__init__()
         self.diagnostics = {}
+        # Diagnostics raised while parsing the body of a single file. These
+        # can be carried over for files that are not parsed again.
+        self.parsing = False
+        self.parse_diagnostics = {}
 
     def emit(  # pylint: disable=R0917
         self,
@@ -71,8 +110,7 @@ class Vscode_Message_Handler(Message_Handler):
         end_range = Position(line=end_line, character=end_col)
         start_range = Position(line=start_line, character=start_col)
         msg = message + (f"\n{extrainfo}" if extrainfo is not None else "")
-        url = urllib.parse.quote(location.file_name.replace("\\", "/"))
-        uri = urllib.parse.urlunparse(("file", "", url, "", "", ""))
+        uri = path_to_uri(location.file_name)
         diag = Diagnostic(
             range=Range(start=start_range, end=end_range),
             message=msg,
@@ -84,6 +122,8 @@ class Vscode_Message_Handler(Message_Handler):
             self.diagnostics[uri].append(diag)
         else:
             self.diagnostics[uri] = [diag]
+        if self.parsing:
+            self.parse_diagnostics.setdefault(uri, []).append(diag)
 
         if fatal:
             raise TRLC_Error(location, kind, message)
@@ -92,76 +132,108 @@ class Vscode_Message_Handler(Message_Handler):
 class File_Handler:
     def __init__(self):
         self.files = {}
+        self.hashes = {}
 
     def update_files(self, uri, content):
         self.files[uri] = content
+        self.hashes[uri] = hashlib.sha1(content.encode("UTF-8")).digest()
 
     def delete_files(self, uri):
         self.files.pop(uri, None)
+        self.hashes.pop(uri, None)
 
 
-class Vscode_Source_Manager(Source_Manager):
-    """Reimplementation of TRLC's Source_Manager to read from vscode's
-    workspace."""
-
-    def __init__(self, mh, fh, ls, verify_mode=True,  # pylint: disable=R0917
-                 exclude_patterns=None):
-        super().__init__(mh=mh, verify_mode=verify_mode)
-        self.fh = fh
-        self.progress = ls.work_done_progress
-        self.ptoken = None
-        # Mirror TRLC CLI default: exclude bazel-* directories.
-        self.exclude_patterns = [re.compile(r"^bazel-.*$")]
-        if exclude_patterns:
-            for pattern in exclude_patterns:
-                self.exclude_patterns.append(re.compile(pattern))
-
-    def callback_parse_begin(self):
-        self.ptoken = str(uuid.uuid4())
-        self.progress.create(self.ptoken)
-        self.progress.begin(
-            self.ptoken,
-            WorkDoneProgressBegin(
-                title="Parsing", percentage=0, cancellable=False
-            ),
-        )
+class Parse_Cancelled(Exception):
+    """Raised when a parse is superseded by newer edits or cancelled by
+    the user."""
 
-    def callback_parse_progress(self, progress):
-        assert isinstance(progress, int)
-        self.progress.report(
-            self.ptoken,
-            WorkDoneProgressReport(
-                message="Parsing (%i%%)" % progress, percentage=progress
-            ),
-        )
 
-    def callback_parse_end(self):
-        self.progress.end(self.ptoken, WorkDoneProgressEnd(message="Finished"))
-
-    def register_workspace(self, dir_name):
-        ok = True
-        for path, dirs, files in os.walk(dir_name):
-            dirs.sort()
-
-            for n, dirname in reversed(list(enumerate(dirs))):
-                keep = True
-                for exclude_pattern in self.exclude_patterns:
-                    if exclude_pattern.match(dirname):
-                        keep = False
-                        break
-                if not keep:
-                    del dirs[n]
-
-            for file_name in sorted(files):
-                if os.path.splitext(file_name)[1] in (".rsl", ".trlc"):
-                    file_path = os.path.join(path, file_name)
-                    url = urllib.parse.quote(file_path.replace("\\", "/"))
-                    uri = urllib.parse.urlunparse(
-                        ("file", "", url, "", "", "")
-                    )
-                    if uri in self.fh.files:
-                        file_content = self.fh.files[uri]
-                    else:
-                        file_content = None
-                    ok &= self.register_file(file_path, file_content)
-        return ok
+class Dependency_Graph:
+    """Package dependencies and per-file results of the last parse.
+
+    Used to work out which packages are affected by an edit: the packages
+    of the changed files and everything depending on them, directly or
+    indirectly. All other packages can be reused as they are, unless one
+    of their files read from disk changed since it was parsed.
+    """
+
+    def __init__(self):
+        self.file_packages = {}
+        self.file_stamps = {}
+        self.depends_on = {}
+        self.parse_diagnostics = {}
+        self.clean_packages = set()
+
+    def reusable_packages(self, changed_files):
+        """Return the set of packages not affected by changes to the given
+        files, or None if the changes require a full parse."""
+        dirty = set()
+        for file_name in changed_files:
+            if file_name not in self.file_packages:
+                return None
+            dirty.add(self.file_packages[file_name])
+
+        dependents = {}
+        for pkg_name, deps in self.depends_on.items():
+            for dep_name in deps:
+                dependents.setdefault(dep_name, set()).add(pkg_name)
+        work_list = set(dirty)
+        while work_list:
+            pkg_name = work_list.pop()
+            for dependent in dependents.get(pkg_name, ()):
+                if dependent not in dirty:
+                    dirty.add(dependent)
+                    work_list.add(dependent)
+
+        reusable = self.clean_packages - dirty
+
+        # Changes on disk are not in changed_files if the client does not
+        # send file system events, or has not sent them yet.
+        for file_name, pkg_name in self.file_packages.items():
+            if (pkg_name in reusable and file_name in self.file_stamps and
+                    disk_stamp(file_name) != self.file_stamps[file_name]):
+                return None
+
+        return reusable
+
+    def update(self, all_files, vsm, vmh):
+        """Record the result of a parse, merging in what has been carried
+        over from the previous one."""
+        self.file_packages = {
+            file_name: (parser.cu.package.name if parser.cu.package
+                        else None)
+            for file_name, parser in all_files.items()
+        }
+
+        depends_on = {pkg_name: deps
+                      for pkg_name, deps in self.depends_on.items()
+                      if pkg_name in vsm.reused_packages}
+        depends_on.update(vsm.package_graph)
+        self.depends_on = depends_on
+
+        file_stamps = {file_name: stamp
+                       for file_name, stamp in self.file_stamps.items()
+                       if file_name in vsm.reused_files}
+        file_stamps.update(vsm.file_stamps)
+        self.file_stamps = file_stamps
+
+        reused_uris = {path_to_uri(file_name)
+                       for file_name in vsm.reused_files}
+        parse_diagnostics = {uri: diagnostics
+                             for uri, diagnostics
+                             in self.parse_diagnostics.items()
+                             if uri in reused_uris}
+        parse_diagnostics.update(vmh.parse_diagnostics)
+        self.parse_diagnostics = parse_diagnostics
+
+        # Only packages that were fully parsed without errors are reused;
+        # anything else is cheap enough to parse again, and must be parsed
+        # again to report the same errors.
+        self.clean_packages = set(self.file_packages.values())
+        self.clean_packages.discard(None)
+        for file_name, parser in all_files.items():
+            diagnostics = parse_diagnostics.get(path_to_uri(file_name), [])
+            if (not (parser.primary or parser.secondary) or
+                    any(diagnostic.severity == DiagnosticSeverity.Error
+                        for diagnostic in diagnostics)):
+                self.clean_packages.discard(self.file_packages[file_name])
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+#
+# TRLC VSCode Extension
+# Copyright (C) 2023 Bayerische Motoren Werke Aktiengesellschaft (BMW AG)
+#
+# This file is part of the TRLC VSCode Extension.
+#
+# The TRLC VSCode Extension is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# The TRLC VSCode Extension is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with TRLC. If not, see <https://www.gnu.org/licenses/>.
+
+"""Formal verification of user defined checks, run in worker processes
+after the diagnostics of a parse have been published."""
+
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+import trlc.ast
+import trlc.vcg
+
+from .trlc_utils import Vscode_Message_Handler
+
+LOGGER = logging.getLogger()
+
+POLL_SECONDS = 0.1
+
+
+def solve_script(solver_class, script, options):
+    solver = solver_class()
+    for name, value in options.items():
+        solver.set_solver_option(name, value)
+    return script.solve_vc(solver)
+
+
+def _solve(script, options):
+    # Runs in a worker process
+    return solve_script(trlc.vcg.CVC5_Solver, script, options)
+
+
+class Cached_Solver(trlc.vcg.SMTLIB_Generator, trlc.vcg.smt.VC_Solver):
+    """Stand-in for the CVC5 solver used by TRLC's VCG. It renders the
+    verification condition to SMTLIB to look it up in the cache, and only
+    runs CVC5 on a miss."""
+
+    def __init__(self, cache, solver_class,  # pylint: disable=R0917
+                 results=None, pending=None):
+        super().__init__()
+        self.cache = cache
+        self.solver_class = solver_class
+        self.results = results or {}
+        self.pending = pending
+        self.script = None
+        self.text = None
+        self.result = None
+        self.model = None
+
+    def visit_script(self, node, logic, functions):
+        self.script = node
+        self.text = super().visit_script(node, logic, functions)
+        return self.text
+
+    def solve(self):
+        key = self.cache.key(self.text, self.options)
+        cached = self.results.get(key) or self.cache.get(key)
+        if cached is not None:
+            self.result, self.model = cached
+        elif self.pending is not None:
+            self.pending[key] = (self.script, dict(self.options))
+            self.result, self.model = "unsat", {}
+        else:
+            self.result, self.model = solve_script(self.solver_class,
+                                                   self.script, self.options)
+            self.cache.put(key, self.result, self.model)
+
+    def get_status(self):
+        return self.result
+
+    def get_values(self):
+        return self.model
+
+
+@contextmanager
+def installed(cache, results=None, pending=None):
+    """Make TRLC's VCG use the given Verification_Cache for as long as the
+    context is active.
+
+    Results given in the results dict take precedence over the cache.
+    If a pending dict is given, conditions that are not known are not
+    solved; their scripts are recorded in pending instead and the
+    solver pretends they hold.
+    """
+    solver_class = trlc.vcg.CVC5_Solver
+
+    def create_solver():
+        return Cached_Solver(cache, solver_class, results, pending)
+
+    trlc.vcg.CVC5_Solver = create_solver
+    try:
+        yield cache
+    finally:
+        trlc.vcg.CVC5_Solver = solver_class
+
+
+class Verifier:
+    """Runs TRLC's VCG on all composite types of a symbol table.
+
+    The VCG itself runs on the calling thread, but solving is deferred: a
+    first pass collects all verification conditions that are not in the
+    cache, these are solved by a pool of worker processes, and each type
+    is then analysed again from the results as soon as all its conditions
+    are solved. Conditions still being solved are shared between runs, so
+    an abandoned run does not waste the work already submitted.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.workers = 0
+        self.pool = None
+        self.running = {}
+        self.lock = threading.Lock()
+
+    def set_workers(self, workers):
+        """Set the number of worker processes; 0 means one per CPU."""
+        if workers != self.workers:
+            self.workers = workers
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+    def get_pool(self):
+        if self.pool is None:
+            # Never fork: the server process is multi-threaded
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers or None,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def submit(self, key, script, options):
+        with self.lock:
+            future = self.running.get(key)
+            if future is None:
+                future = self.get_pool().submit(_solve, script, options)
+                self.running[key] = future
+                future.add_done_callback(
+                    lambda done: self.store(key, done))
+        return future
+
+    def store(self, key, future):
+        with self.lock:
+            self.running.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, *future.result())
+
+    def analyze(self, types, results=None, pending=None):
+        mh = Vscode_Message_Handler()
+        with installed(self.cache, results, pending):
+            for n_typ in types:
+                trlc.vcg.VCG(mh=mh, n_ctyp=n_typ, debug=False).analyze()
+        return mh.diagnostics
+
+    def verify(self, stab, publish, cancelled):
+        """Verify all checks in the symbol table.
+
+        publish is called with the diagnostics (by URI) of every batch of
+        types whose verification is complete, starting with the types
+        whose results are all cached. Returns False if cancelled
+        returned True before everything was verified.
+        """
+        types = [n_typ
+                 for package in stab.values(trlc.ast.Package)
+                 for n_typ in package.symbols.values(trlc.ast.Composite_Type)]
+
+        # First pass: find out what has to be solved
+        waiting = {}
+        scripts = {}
+        for n_typ in types:
+            pending = {}
+            self.analyze([n_typ], pending=pending)
+            waiting[n_typ] = set(pending)
+            scripts.update(pending)
+
+        # Always published, even if empty, to mark the end of the first pass
+        publish(self.analyze([n_typ for n_typ in types
+                              if not waiting[n_typ]]))
+        if not scripts:
+            return True
+
+        futures = {}
+        for key, (script, options) in scripts.items():
+            futures.setdefault(self.submit(key, script, options),
+                               []).append(key)
+
+        results = {}
+        while futures:
+            if cancelled():
+                return False
+            done, _ = wait(futures, timeout=POLL_SECONDS,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                for key in futures.pop(future):
+                    try:
+                        results[key] = future.result()
+                    except Exception:  # pylint: disable=W0718
+                        LOGGER.error("TRLC: Verification worker failed",
+                                     exc_info=True)
+                        script, options = scripts[key]
+                        results[key] = solve_script(trlc.vcg.CVC5_Solver,
+                                                    script, options)
+
+            ready = []
+            for n_typ, keys in waiting.items():
+                if keys and keys.issubset(results):
+                    keys.clear()
+                    ready.append(n_typ)
+            if ready:
+                publish(self.analyze(ready, results))
+
+        return True